@@ -43,8 +43,11 @@ def analyze_dataset():
     for person_folder in sorted(dataset_path.iterdir()):
         if person_folder.is_dir() and not person_folder.name.startswith('.'):
             # Count images
-            images = list(person_folder.glob('*.[jJ][pP]*[gG]')) + list(person_folder.glob('*.png'))
-            count = len(images)
+            with os.scandir(person_folder) as entries:
+                count = sum(
+                    1 for e in entries
+                    if e.is_file() and os.path.splitext(e.name)[1].lower() in ('.jpg', '.jpeg', '.png')
+                )
             
             if count > 0:
                 stats.append({
@@ -41,6 +41,8 @@ COLLECTION_NAME = os.getenv("COLLECTION_NAME", "face_embeddings")
 # Face Recognition Settings
 FACE_SIZE = 160  # Standard face image size for preprocessing
 MIN_FACE_CONFIDENCE = float(os.getenv("MIN_FACE_CONFIDENCE", 0.5))
+# Decode large JPEG selfies at a 1/2-1/8 DCT scale keeping the shorter side >= this (0 = full size; needs PyTurboJPEG)
+SELFIE_DECODE_MIN_SIDE = int(os.getenv("SELFIE_DECODE_MIN_SIDE", 0))
 # Super-Ensemble Settings
 # Super-Ensemble Settings
 ENABLE_ENSEMBLE = os.getenv("ENABLE_ENSEMBLE", "false").lower() == "true"
@@ -48,13 +50,42 @@ if ENABLE_ENSEMBLE:
     EMBEDDING_DIM = 1024  # ArcFace (512) + FaceNet512 (512)
 else:
     EMBEDDING_DIM = 512  # FaceNet512 only
+# Test Time Augmentation (flip) for embeddings generated during photo upload.
+# Selfies always use TTA, so turning this off makes new gallery vectors less
+# comparable with selfies and with faces already in the index
+ENABLE_TTA = os.getenv("ENABLE_TTA", "true").lower() == "true"
+# Recognition model precision: "float32" or "mixed_float16" (opt-in; only applied to
+# the FaceNet/ArcFace build when a GPU is present, and it changes embeddings slightly)
+MODEL_PRECISION = os.getenv("MODEL_PRECISION", "float32")
+# TensorFlow intra-op threads for CPU inference (0 = let TensorFlow decide)
+INFERENCE_THREADS = int(os.getenv("INFERENCE_THREADS", 0))
 SIMILARITY_THRESHOLD = float(os.getenv("SIMILARITY_THRESHOLD", 0.55))  # Read from .env
+# Vector encoding inside the IVF index used above 1000 faces (FAISS factory syntax):
+# "SQ8" stores int8 per dimension (4x smaller, near-exact scores), "Flat" exact float32,
+# "PQ64x8" 64 bytes per face (approximate scores)
+FAISS_IVF_ENCODING = os.getenv("FAISS_IVF_ENCODING", "SQ8")
+# Serve unfiltered searches from a GPU copy of the index (needs faiss-gpu and a CUDA device)
+FAISS_USE_GPU = os.getenv("FAISS_USE_GPU", "true").lower() == "true"
 MAX_FACES_PER_IMAGE = 50  # Maximum number of faces to detect per image
 
+# Google Drive import: images processed concurrently per import task
+DRIVE_CONCURRENCY = int(os.getenv("DRIVE_CONCURRENCY", 4))
+
 # Privacy & Security
 ENABLE_PRIVACY_MODE = os.getenv("ENABLE_PRIVACY_MODE", "true").lower() == "true"
 MAX_RESULTS = int(os.getenv("MAX_RESULTS", 100))
 
+# AI search: on-disk copy of the Groq query-parse cache (survives restarts)
+AI_PARSE_CACHE_DB = BASE_DIR / os.getenv("AI_PARSE_CACHE_DB", "data/ai_parse_cache.sqlite")
+
+# Guest search: selfie embeddings cached by image hash (skips detection + embedding on repeats)
+SELFIE_CACHE_DB = BASE_DIR / os.getenv("SELFIE_CACHE_DB", "data/selfie_cache.sqlite")
+
+# Session Management
+SESSION_TIMEOUT_MINUTES = int(os.getenv("SESSION_TIMEOUT_MINUTES", 30))
+# Shared session store; leave empty to keep sessions in process memory (single worker only)
+REDIS_URL = os.getenv("REDIS_URL", "")
+
 # Create necessary directories
 UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
 SELFIE_DIR.mkdir(parents=True, exist_ok=True)
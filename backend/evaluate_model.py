@@ -88,10 +88,15 @@ def evaluate():
     model.to(DEVICE)
     model.eval()
 
-    # 2. Load Models for Preprocessing
+    # 2. Load Models for Preprocessing (the same embedder the classifier was trained on)
     print("Loading AI models for feature extraction...")
-    face_detector = FaceDetector()
-    face_recognizer = get_facenet_model()
+    embedder = None
+    if checkpoint.get('embedder') == 'insightface':
+        from models.insightface_embedder import InsightFaceEmbedder
+        embedder = InsightFaceEmbedder(use_gpu=DEVICE.type == 'cuda')
+    else:
+        face_detector = FaceDetector()
+        face_recognizer = get_facenet_model()
 
     # 3. Process Dataset (Same logic as training to ensure consistency)
     # real-world: you might want a separate 'test_dataset' folder
@@ -118,6 +123,13 @@ def evaluate():
             image = load_image(str(img_path))
             if image is None: continue
             
+            if embedder is not None:
+                emb = embedder.embed_image(image)
+                if emb is not None:
+                    embeddings.append(emb)
+                    y_true.append(label_idx)
+                continue
+            
             faces = face_detector.detect_faces(image)
             if not faces: continue
             
@@ -5,10 +5,13 @@ FastAPI application for facial recognition-based photo retrieval.
 
 from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Depends, BackgroundTasks, Header, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from fastapi.encoders import jsonable_encoder
 from typing import List, Optional
 import uvicorn
 import uuid
+import json
+import asyncio
 from pathlib import Path
 from pydantic import BaseModel
 
@@ -16,7 +19,7 @@ from services.admin_service import get_admin_service, AdminService
 from services.guest_service import get_guest_service, GuestService
 from services.ai_search_service import get_ai_search_service, AISearchService
 from services.room_service import get_room_service, RoomService
-from services.drive_service import get_drive_service
+from services.drive_service import get_drive_service, task_store
 
 import config
 
@@ -73,11 +76,15 @@ class ResetDatabaseRequest(BaseModel):
 class JoinRoomRequest(BaseModel):
     room_id: str
 
+class DeletePhotosRequest(BaseModel):
+    filenames: List[str]
+
 @app.post("/api/rooms/create")
 async def create_room(request: CreateRoomRequest):
     """Create a new event room."""
     service = get_room_service()
-    return service.create_room(request.event_name, request.password)
+    # bcrypt hashing is deliberately slow; keep it off the event loop
+    return await asyncio.to_thread(service.create_room, request.event_name, request.password)
 
 @app.post("/api/rooms/join")
 async def join_room(request: JoinRoomRequest):
@@ -107,6 +114,14 @@ async def import_drive(
     
     return {"task_id": task_id, "message": "Background processing started"}
 
+@app.get("/admin/task-status/{task_id}")
+async def get_task_status(task_id: str):
+    """Get the progress of a Google Drive import."""
+    status = task_store.get(task_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    return status
+
 @app.get("/")
 async def root():
     return {
@@ -196,6 +211,24 @@ async def delete_photo(
     
     return result
 
+@app.post("/admin/photos/delete")
+async def delete_photos(
+    request: DeletePhotosRequest,
+    admin_service: AdminService = Depends(get_current_room_admin_service)
+):
+    """Admin endpoint: Delete several photos and their embeddings in one batch."""
+    if not request.filenames:
+        raise HTTPException(status_code=400, detail="No filenames provided")
+    
+    photo_paths = [str(admin_service.upload_dir / Path(name).name) for name in request.filenames]
+    
+    result = admin_service.delete_photos_batch(photo_paths)
+    
+    if not result['success']:
+        raise HTTPException(status_code=500, detail=result.get('error', 'Deletion failed'))
+    
+    return result
+
 @app.post("/admin/database/reset")
 async def reset_database(
     request: ResetDatabaseRequest,
@@ -212,7 +245,7 @@ async def reset_database(
 
     # Verify password
     room_service = get_room_service()
-    if not room_service.verify_password(x_room_id, request.password):
+    if not await asyncio.to_thread(room_service.verify_password, x_room_id, request.password):
         raise HTTPException(status_code=403, detail="Invalid room password")
 
     result = admin_service.reset_database()
@@ -344,38 +377,24 @@ async def ai_search_upload_selfie(
     
     selfie_bytes = await selfie.read()
     
-    # 1. Validate Face via Guest Service
-    validation = guest_service.validate_selfie(selfie_bytes)
-    if not validation['valid']:
-        raise HTTPException(status_code=400, detail=validation.get('error', 'No face detected'))
+    # 1. Validate Face via Guest Service (decode + detect once)
+    image, face_result = guest_service.detect_selfie_face(selfie_bytes)
+    if image is None:
+        raise HTTPException(status_code=400, detail="Invalid image file")
+    if face_result is None:
+        raise HTTPException(status_code=400, detail="No face detected. Please upload a clear selfie.")
     
-    # 2. Generate Embedding (using code from Main logic or helper)
-    # We can reuse the logic from GuestService or do it here.
-    # To keep it DRY, let's duplicate the logic slightly or see if GuestService can give us embedding.
-    # GuestService doesn't expose embedding generation directly in public API efficiently (it does search).
-    # We can use the lower level models directly since we are in backend.
-    
-    from utils.image_processing import load_image_from_bytes, crop_face, preprocess_face
-    from models.face_recognition import get_facenet_model
-    
-    image = load_image_from_bytes(selfie_bytes)
-    faces = guest_service.face_detector.detect_faces(image)
-    if not faces:
-         raise HTTPException(status_code=400, detail="No face detected")
-    
-    bbox, confidence = faces[0]
-    face_img = crop_face(image, bbox)
-    preprocessed = preprocess_face(face_img, config.FACE_SIZE)
-    
-    facenet = get_facenet_model()
-    embedding = facenet.generate_embedding(preprocessed, enable_tta=True)
+    # 2. Generate Embedding, reusing the decoded image and detected face
+    embedding, error = guest_service.get_selfie_embedding(
+        selfie_bytes, selfie.filename, image=image, face_result=face_result
+    )
     
     if embedding is None:
-        raise HTTPException(status_code=500, detail="Failed to generate embedding")
+        raise HTTPException(status_code=500, detail=error or "Failed to generate embedding")
         
     # 3. Create Session
     session_id = ai_service.create_session(
-        face_embedding=embedding.tolist(),
+        face_embedding=embedding,
         selfie_filename=selfie.filename
     )
     
@@ -394,7 +413,7 @@ async def ai_search_query(
     """
     AI Search: Process natural language query and search photos.
     """
-    result = ai_service.search_photos(
+    result = await ai_service.search_photos(
         session_id=request.session_id,
         user_query=request.query
     )
@@ -404,6 +423,24 @@ async def ai_search_query(
     
     return result
 
+@app.post("/guest/ai-search/query/stream")
+async def ai_search_query_stream(
+    request: AIQueryRequest,
+    ai_service: AISearchService = Depends(get_current_room_ai_service)
+):
+    """
+    AI Search (streaming): Server-Sent Events with the AI message tokens as they
+    are generated, followed by a final 'result' event with the matched photos.
+    """
+    async def event_stream():
+        async for event in ai_service.search_photos_stream(
+            session_id=request.session_id,
+            user_query=request.query
+        ):
+            yield f"data: {json.dumps(jsonable_encoder(event))}\n\n"
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
 @app.get("/guest/ai-search/locations")
 async def get_available_locations(
     ai_service: AISearchService = Depends(get_current_room_ai_service)
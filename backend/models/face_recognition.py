@@ -12,13 +12,66 @@ Architecture:
 
 import numpy as np
 from deepface import DeepFace
+from pathlib import Path
 from typing import Optional, List
 import config
 import cv2
 import logging
 
+try:
+    import onnxruntime as ort
+except ImportError:  # optional: only used by enable_onnx()
+    ort = None
+
 logger = logging.getLogger(__name__)
 
+
+def _configure_inference_threads():
+    """Pin the TensorFlow intra-op thread pool when configured (before TensorFlow initializes)."""
+    if config.INFERENCE_THREADS <= 0:
+        return
+    try:
+        import tensorflow as tf
+        tf.config.threading.set_intra_op_parallelism_threads(config.INFERENCE_THREADS)
+    except ImportError:
+        return
+    except Exception as e:
+        # Must run before TensorFlow initializes; ignore if it already has
+        logger.warning(f"Could not configure inference threads: {e}")
+
+
+def _build_recognition_model(model_name: str):
+    """
+    Build one recognition model, in mixed precision when opted in.
+    
+    With MODEL_PRECISION=mixed_float16 on a GPU, the convolutions run on FP16
+    tensor cores (variables stay FP32). Keras layers capture the dtype policy
+    when they are built, so the policy is set only around this build and the
+    previous one restored; models built later (e.g. the RetinaFace detector)
+    stay in float32.
+    """
+    mixed_precision = None
+    if config.MODEL_PRECISION == "mixed_float16":
+        try:
+            import tensorflow as tf
+            if tf.config.list_physical_devices('GPU'):
+                mixed_precision = tf.keras.mixed_precision
+        except ImportError:
+            pass
+    
+    if mixed_precision is None:
+        return DeepFace.build_model(model_name)
+    
+    previous = mixed_precision.global_policy()
+    mixed_precision.set_global_policy('mixed_float16')
+    try:
+        model = DeepFace.build_model(model_name)
+        print(f"{model_name} precision: mixed_float16 (GPU)")
+        return model
+    finally:
+        mixed_precision.set_global_policy(previous)
+
+
 class FaceNet:
     """
     Super-Ensemble Face Recognition.
@@ -38,14 +91,20 @@ class FaceNet:
 
         self.input_size = (160, 160) 
         self.input_size = (160, 160)
+        # Identifies the embedding space; cached embeddings are keyed on it
+        self.model_version = "+".join(f"{m}:{w}" for m, w in zip(self.models, self.weights))
         
         self.loaded_models = {}
+        # ONNX Runtime sessions that replace the Keras forward in batched calls
+        self.onnx_sessions = {}
+        
+        _configure_inference_threads()
         
         print("Loading Super-Ensemble Models into Memory (This runs once)...")
         for model_name in self.models:
             print(f"Loading {model_name}...")
             try:
-                self.loaded_models[model_name] = DeepFace.build_model(model_name)
+                self.loaded_models[model_name] = _build_recognition_model(model_name)
                 print(f"Loaded {model_name} successfully.")
             except Exception as e:
                 print(f"CRITICAL ERROR loading {model_name}: {e}")
@@ -74,6 +133,100 @@ class FaceNet:
             print(f"CLAHE Warning: {e}")
             return img
 
+    def _prepare_image(self, face_image: np.ndarray) -> np.ndarray:
+        """Convert a preprocessed face crop back to uint8 RGB and apply CLAHE."""
+        if face_image.max() <= 1.0:
+            img_uint8 = (((face_image + 1) / 2) * 255).astype(np.uint8)
+        else:
+            img_uint8 = face_image.astype(np.uint8)
+        
+        if len(img_uint8.shape) == 2:
+            img_uint8 = cv2.cvtColor(img_uint8, cv2.COLOR_GRAY2RGB)
+        elif img_uint8.shape[2] == 4:
+            img_uint8 = cv2.cvtColor(img_uint8, cv2.COLOR_RGBA2RGB)
+        
+        # --- Illumination Normalization (CLAHE) ---
+        return self._apply_clahe(img_uint8)
+
+    def _forward_batch(self, model_name: str, images: List[np.ndarray]) -> np.ndarray:
+        """
+        Run one model on a list of uint8 images in a single forward pass.
+        
+        Mirrors DeepFace.represent(detector_backend='skip', align=False) for each
+        image (channel flip, padded resize to the model input, base normalization).
+        
+        Returns:
+            (len(images), dim) array of raw embeddings
+        """
+        from deepface.modules import preprocessing
+        
+        loaded_model = self.loaded_models[model_name]
+        target_size = loaded_model.input_shape
+        batch = np.concatenate([
+            preprocessing.normalize_input(
+                preprocessing.resize_image(img[:, :, ::-1], (target_size[1], target_size[0]))
+            )
+            for img in images
+        ])
+        
+        session = self.onnx_sessions.get(model_name)
+        if session is not None:
+            return session.run(None, {session.get_inputs()[0].name: batch.astype(np.float32)})[0]
+        
+        try:
+            return np.asarray(loaded_model.model(batch, training=False))
+        except Exception as e:
+            # Non-Keras model: fall back to one forward per image
+            logger.warning(f"Batched forward failed for {model_name}, running per image: {e}")
+            return np.array([loaded_model.forward(batch[i:i + 1]) for i in range(len(batch))])
+
+    def to_onnx(self, model_name: str, path: Path) -> Path:
+        """
+        Export one loaded Keras model to ONNX (batch dimension left dynamic).
+        
+        Args:
+            model_name: Ensemble member to export (e.g. "ArcFace")
+            path: Output .onnx file
+        """
+        import tensorflow as tf
+        import tf2onnx
+        
+        keras_model = self.loaded_models[model_name].model
+        spec = (tf.TensorSpec((None, *keras_model.input_shape[1:]), tf.float32, name='input'),)
+        tf2onnx.convert.from_keras(keras_model, input_signature=spec, opset=17, output_path=str(path))
+        return Path(path)
+
+    def enable_onnx(self, cache_dir: Path, use_gpu: bool = True) -> bool:
+        """
+        Run batched embeddings (generate_embeddings_batch) through ONNX Runtime.
+        
+        Each ensemble model is exported once to cache_dir and reused afterwards.
+        Single-image generate_embedding() keeps using DeepFace.
+        
+        Returns:
+            True if every model now has an ONNX session
+        """
+        if ort is None:
+            logger.warning("onnxruntime not installed; keeping TensorFlow inference")
+            return False
+        
+        cache_dir = Path(cache_dir)
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        providers = ['CUDAExecutionProvider', 'CPUExecutionProvider'] if use_gpu else ['CPUExecutionProvider']
+        
+        for model_name in self.models:
+            try:
+                path = cache_dir / f"{model_name}.onnx"
+                if not path.exists():
+                    print(f"Exporting {model_name} to ONNX...")
+                    self.to_onnx(model_name, path)
+                self.onnx_sessions[model_name] = ort.InferenceSession(str(path), providers=providers)
+                print(f"{model_name}: ONNX Runtime session ready")
+            except Exception as e:
+                logger.warning(f"ONNX export/load failed for {model_name}, using TensorFlow: {e}")
+        
+        return len(self.onnx_sessions) == len(self.models)
+
     def generate_embedding(self, face_image: np.ndarray, enable_tta: bool = True) -> Optional[np.ndarray]:
         """
         Generate 1024-dimensional Super-Vector.
@@ -86,19 +239,7 @@ class FaceNet:
             return None
         
         try:
-            # Prepare image
-            if face_image.max() <= 1.0:
-                img_uint8 = (((face_image + 1) / 2) * 255).astype(np.uint8)
-            else:
-                img_uint8 = face_image.astype(np.uint8)
-            
-            if len(img_uint8.shape) == 2:
-                img_uint8 = cv2.cvtColor(img_uint8, cv2.COLOR_GRAY2RGB)
-            elif img_uint8.shape[2] == 4:
-                img_uint8 = cv2.cvtColor(img_uint8, cv2.COLOR_RGBA2RGB)
-            
-            # --- Illumination Normalization (CLAHE) ---
-            img_uint8 = self._apply_clahe(img_uint8)
+            img_uint8 = self._prepare_image(face_image)
             
             # --- Test Time Augmentation (TTA) ---
             images = [img_uint8]
@@ -170,21 +311,69 @@ class FaceNet:
             print(f"Error generating super-embedding: {e}")
             return None
     
-    def generate_embeddings_batch(self, face_images: list) -> list:
-        """Batch generation."""
+    def generate_embeddings_batch(self, face_images: list, enable_tta: bool = True) -> List[Optional[np.ndarray]]:
+        """
+        Generate Super-Vectors for many faces with one forward pass per model.
+        
+        TTA flips are appended to the same batch (rather than doubling the
+        number of calls) and averaged per face afterwards.
+        
+        Args:
+            face_images: Input face crops
+            enable_tta: Enable Test Time Augmentation (Flip)
+            
+        Returns:
+            One embedding per input face (None where it could not be generated)
+        """
         if not face_images:
             return []
         
-        embeddings = []
-        for face_image in face_images:
-            try:
-                embedding = self.generate_embedding(face_image)
-                if embedding is not None:
-                    embeddings.append(embedding.tolist())
-            except Exception:
+        results: List[Optional[np.ndarray]] = [None] * len(face_images)
+        valid_idx, images = [], []
+        for idx, face_image in enumerate(face_images):
+            if face_image is None:
                 continue
+            try:
+                images.append(self._prepare_image(face_image))
+                valid_idx.append(idx)
+            except Exception as e:
+                print(f"Error preparing face {idx}: {e}")
+        
+        if not images:
+            return results
+        
+        n_views = 2 if enable_tta else 1
+        if enable_tta:
+            images = images + [cv2.flip(img, 1) for img in images]
+        
+        try:
+            super_vector_parts = []
+            for model_name, weight in zip(self.models, self.weights):
+                if not self.loaded_models.get(model_name):
+                    print(f"Model {model_name} not loaded! Skipping.")
+                    return results
+                
+                embs = self._forward_batch(model_name, images)
+                # (views * n, dim) -> (n, dim): average each face with its flip
+                embs = embs.reshape(n_views, len(valid_idx), -1).mean(axis=0)
+                
+                # Normalize first, then apply Feature Weighting
+                norms = np.linalg.norm(embs, axis=1, keepdims=True)
+                embs = np.divide(embs, norms, out=embs, where=norms > 0)
+                super_vector_parts.append(embs * weight)
+            
+            # --- Fusion ---
+            super_vectors = np.concatenate(super_vector_parts, axis=1)
+            norms = np.linalg.norm(super_vectors, axis=1, keepdims=True)
+            super_vectors = np.divide(super_vectors, norms, out=super_vectors, where=norms > 0)
+            super_vectors = super_vectors.astype(np.float32)
+            
+            for row, idx in enumerate(valid_idx):
+                results[idx] = super_vectors[row]
+        except Exception as e:
+            print(f"Error generating batched super-embeddings: {e}")
         
-        return embeddings
+        return results
 
 # Global instance
 _facenet_instance = None
@@ -0,0 +1,64 @@
+"""
+InsightFace Embedder (optional training backend).
+Runs detection and recognition in one call through an InsightFace model pack
+(e.g. buffalo_s), returning a 512-dim normalized embedding per face.
+
+Note: these embeddings live in a different space than the DeepFace
+Super-Ensemble used for photo search; classifiers trained on them must be
+evaluated with the same embedder.
+"""
+
+import numpy as np
+from typing import Optional
+import logging
+
+try:
+    from insightface.app import FaceAnalysis
+except ImportError:  # optional: pip install insightface onnxruntime-gpu
+    FaceAnalysis = None
+
+logger = logging.getLogger(__name__)
+
+
+class InsightFaceEmbedder:
+    """Fused face detection + embedding via insightface.app.FaceAnalysis."""
+
+    def __init__(self, model_name: str = 'buffalo_s', use_gpu: bool = True, det_size: int = 640):
+        """
+        Load the model pack.
+
+        Args:
+            model_name: InsightFace model pack name
+            use_gpu: Prefer the CUDA execution provider (falls back to CPU)
+            det_size: Detector input size (square)
+        """
+        if FaceAnalysis is None:
+            raise ImportError("insightface not installed. Run: pip install insightface onnxruntime-gpu")
+
+        providers = ['CUDAExecutionProvider', 'CPUExecutionProvider'] if use_gpu else ['CPUExecutionProvider']
+        self.app = FaceAnalysis(name=model_name, providers=providers)
+        self.app.prepare(ctx_id=0 if use_gpu else -1, det_size=(det_size, det_size))
+        # Identifies the embedding space (stored with trained classifiers)
+        self.model_version = f"insightface:{model_name}"
+        print(f"InsightFace embedder ready ({model_name})")
+
+    def embed_image(self, image: np.ndarray) -> Optional[np.ndarray]:
+        """
+        Detect faces and return the embedding of the largest one.
+
+        Args:
+            image: Input image (RGB)
+
+        Returns:
+            512-dim L2-normalized float32 embedding, or None if no face was found
+        """
+        if image is None or image.size == 0:
+            return None
+
+        # InsightFace expects BGR
+        faces = self.app.get(np.ascontiguousarray(image[:, :, ::-1]))
+        if not faces:
+            return None
+
+        largest = max(faces, key=lambda f: (f.bbox[2] - f.bbox[0]) * (f.bbox[3] - f.bbox[1]))
+        return largest.normed_embedding.astype(np.float32)
@@ -4,11 +4,15 @@ Enables location-based photo search.
 """
 
 import pickle
+from bisect import bisect_left, bisect_right
+from datetime import date
 from pathlib import Path
-from typing import List, Dict, Optional, Tuple
+from typing import List, Dict, Optional, Set, Tuple
 import config
 import logging
 
+from utils.exif_extractor import EXIFExtractor, parse_exif_timestamp
+
 logger = logging.getLogger(__name__)
 
 
@@ -45,6 +49,13 @@ class LocationDB:
         # }
         self.locations = {}
         
+        # Derived lookup indexes, rebuilt lazily after any change:
+        #   _loc_index: {location_name_lower: set(photo_path)}
+        #   _dates / _date_keys: parallel lists sorted by photo date
+        self._loc_index = None
+        self._dates = None
+        self._date_keys = None
+        
         # Load existing database
         self._load_db()
     
@@ -54,6 +65,7 @@ class LocationDB:
             try:
                 with open(self.db_path, 'rb') as f:
                     self.locations = pickle.load(f)
+                self._invalidate_indexes()
                 logger.info(f"Loaded location database with {len(self.locations)} photos")
             except Exception as e:
                 logger.error(f"Failed to load location database: {e}")
@@ -61,6 +73,58 @@ class LocationDB:
         else:
             logger.info("No existing location database found, starting fresh")
     
+    def _invalidate_indexes(self):
+        """Drop derived indexes; they are rebuilt on next lookup."""
+        self._loc_index = None
+        self._dates = None
+        self._date_keys = None
+    
+    def _build_indexes(self):
+        """Build the location-name and date indexes from self.locations."""
+        loc_index = {}
+        dated = []
+        
+        for photo_path, metadata in self.locations.items():
+            location_name = metadata.get('location_name')
+            if location_name:
+                loc_index.setdefault(location_name.lower(), set()).add(photo_path)
+            
+            taken_at = parse_exif_timestamp(metadata.get('timestamp'))
+            if taken_at:
+                dated.append((taken_at.date(), photo_path))
+        
+        dated.sort()
+        self._dates = [d for d, _ in dated]
+        self._date_keys = [k for _, k in dated]
+        self._loc_index = loc_index
+    
+    def photos_matching_location(self, location_query: str) -> Set[str]:
+        """
+        Get photo keys whose location name contains the query (case-insensitive).
+        Scans unique location names only, not every photo.
+        """
+        if self._loc_index is None:
+            self._build_indexes()
+        
+        query_lower = location_query.lower()
+        matches = set()
+        for location_name, photo_paths in self._loc_index.items():
+            if query_lower in location_name:
+                matches |= photo_paths
+        return matches
+    
+    def photos_in_date_range(self, start: Optional[date], end: Optional[date]) -> Set[str]:
+        """
+        Get photo keys whose timestamp falls within [start, end] (either bound optional).
+        Uses binary search over the date-sorted index.
+        """
+        if self._dates is None:
+            self._build_indexes()
+        
+        lo = bisect_left(self._dates, start) if start else 0
+        hi = bisect_right(self._dates, end) if end else len(self._dates)
+        return set(self._date_keys[lo:hi])
+    
     def _save_db(self):
         """Save database to disk."""
         try:
@@ -89,10 +153,50 @@ class LocationDB:
                 'camera_model': str(metadata.get('camera_model')) if metadata.get('camera_model') else None,
                 'altitude': float(metadata.get('altitude')) if metadata.get('altitude') is not None else None
             }
+            self._invalidate_indexes()
             self._save_db()
             logger.info(f"Added location for {Path(photo_path).name}: "
                        f"{metadata['latitude']:.4f}, {metadata['longitude']:.4f}")
     
+    def fill_missing_location_names(self, photo_keys: Optional[List[str]] = None) -> int:
+        """
+        Reverse geocode photos that have coordinates but no location name.
+        All points are resolved in one batch and the database is saved once.
+        
+        Args:
+            photo_keys: Restrict to these photos (default: every photo)
+            
+        Returns:
+            Number of photos that got a location name
+        """
+        keys = self.locations.keys() if photo_keys is None else photo_keys
+        pending = [
+            key for key in keys
+            if key in self.locations
+            and not self.locations[key].get('location_name')
+            and self.locations[key].get('latitude') is not None
+            and self.locations[key].get('longitude') is not None
+        ]
+        if not pending:
+            return 0
+        
+        coords = [
+            (self.locations[key]['latitude'], self.locations[key]['longitude'])
+            for key in pending
+        ]
+        names = EXIFExtractor.reverse_geocode_batch(coords)
+        
+        filled = 0
+        for key, name in zip(pending, names):
+            if name:
+                self.locations[key]['location_name'] = name
+                filled += 1
+        
+        if filled:
+            self._invalidate_indexes()
+            self._save_db()
+        return filled
+    
     def search_by_location(
         self,
         target_lat: float,
@@ -194,16 +298,33 @@ class LocationDB:
         Returns:
             True if deleted, False if not found
         """
-        if photo_path in self.locations:
-            del self.locations[photo_path]
+        return self.delete_by_photos([photo_path]) > 0
+    
+    def delete_by_photos(self, photo_paths: List[str]) -> int:
+        """
+        Delete location data for several photos, saving once.
+        
+        Args:
+            photo_paths: Paths of the photos
+            
+        Returns:
+            Number of photos that had location data
+        """
+        deleted = 0
+        for photo_path in photo_paths:
+            if self.locations.pop(photo_path, None) is not None:
+                deleted += 1
+        
+        if deleted:
+            self._invalidate_indexes()
             self._save_db()
-            logger.info(f"Deleted location data for {Path(photo_path).name}")
-            return True
-        return False
+            logger.info(f"Deleted location data for {deleted} photo(s)")
+        return deleted
     
     def reset(self):
         """Reset the entire location database."""
         self.locations = {}
+        self._invalidate_indexes()
         self._save_db()
         logger.info("Location database reset")
     
@@ -0,0 +1,122 @@
+"""
+Processed File Index.
+Remembers content hashes of imported photos so re-shared Drive folders
+don't run face detection again on files that are already indexed.
+"""
+
+import sqlite3
+import hashlib
+import threading
+from pathlib import Path
+from typing import List, Optional
+import config
+import logging
+
+try:
+    import xxhash
+except ImportError:  # optional speedup; hashlib.blake2b is used otherwise
+    xxhash = None
+
+logger = logging.getLogger(__name__)
+
+_CHUNK_SIZE = 1 << 20
+
+
+def file_digest(path: Path) -> str:
+    """Content hash of a file (xxh3-128 when available, else BLAKE2b)."""
+    h = xxhash.xxh3_128() if xxhash is not None else hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(_CHUNK_SIZE)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class ProcessedFileIndex:
+    """SQLite table mapping content hash -> indexed photo path."""
+    
+    def __init__(self, persist_dir: str = None):
+        """
+        Initialize the index.
+        
+        Args:
+            persist_dir: Directory to persist the database (same as the room's vector DB)
+        """
+        self.persist_dir = Path(persist_dir or config.CHROMA_PERSIST_DIR)
+        self.persist_dir.mkdir(parents=True, exist_ok=True)
+        self.db_path = self.persist_dir / "processed_files.sqlite"
+        self._lock = threading.Lock()
+        
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS processed_files (hash TEXT PRIMARY KEY, photo_path TEXT)"
+        )
+        self._conn.commit()
+    
+    def find(self, digest: str) -> Optional[str]:
+        """
+        Get the photo already indexed with this content hash.
+        
+        Returns:
+            The photo path, or None if unknown or the photo has since been deleted
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT photo_path FROM processed_files WHERE hash = ?", (digest,)
+            ).fetchone()
+        if row is None:
+            return None
+        if not Path(row[0]).exists():
+            # Deleted (or room reset) since: let it be processed again
+            return None
+        return row[0]
+    
+    def add(self, digest: str, photo_path: str):
+        """Record a processed photo."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO processed_files (hash, photo_path) VALUES (?, ?)",
+                (digest, photo_path)
+            )
+
+    def delete_by_photos(self, photo_paths: List[str]) -> int:
+        """
+        Forget the hashes of deleted photos.
+
+        Returns:
+            Number of rows removed
+        """
+        with self._lock, self._conn:
+            cur = self._conn.executemany(
+                "DELETE FROM processed_files WHERE photo_path = ?",
+                [(str(p),) for p in photo_paths]
+            )
+        return cur.rowcount
+
+    def reset(self):
+        """Forget every recorded hash."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM processed_files")
+
+
+# Global instances cache
+_processed_file_indexes = {}
+
+
+def get_processed_file_index(room_id: str = None) -> ProcessedFileIndex:
+    """
+    Get or create the processed file index for a specific room.
+    """
+    key = room_id or 'default'
+    
+    if key not in _processed_file_indexes:
+        if room_id:
+            from services.room_service import get_room_service
+            persist_dir = get_room_service().get_room_path(room_id) / "chromadb"
+        else:
+            persist_dir = None
+        _processed_file_indexes[key] = ProcessedFileIndex(persist_dir=persist_dir)
+    
+    return _processed_file_indexes[key]
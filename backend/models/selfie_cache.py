@@ -0,0 +1,102 @@
+"""
+Selfie Embedding Cache.
+Persists selfie face embeddings keyed by image hash so a re-submitted
+selfie skips face detection and embedding generation.
+"""
+
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Optional
+import logging
+
+import numpy as np
+from cachetools import LRUCache
+
+import config
+
+logger = logging.getLogger(__name__)
+
+
+class SelfieEmbeddingCache:
+    """SQLite-backed embedding cache with an in-process LRU in front."""
+    
+    def __init__(self, db_path: str = None, memory_size: int = 512):
+        """
+        Initialize the cache.
+        
+        Args:
+            db_path: SQLite file to persist embeddings in
+            memory_size: Number of embeddings kept in memory
+        """
+        self.db_path = str(db_path or config.SELFIE_CACHE_DB)
+        self._memory = LRUCache(maxsize=memory_size)
+        self._lock = threading.Lock()
+        
+        self._conn = None
+        try:
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS selfie_embeddings ("
+                "hash TEXT PRIMARY KEY, embedding BLOB, dim INTEGER, ts INTEGER)"
+            )
+            self._conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Failed to open selfie cache database, using memory only: {e}")
+            self._conn = None
+    
+    @staticmethod
+    def make_key(image_bytes: bytes, model_version: str, decode_min_side: int, enable_tta: bool) -> str:
+        """
+        Cache key: SHA-256 of the image bytes, scoped to the embedding model
+        and the settings that change the embedding (decode size, TTA).
+        """
+        digest = hashlib.sha256(image_bytes).hexdigest()
+        return f"{model_version}:{decode_min_side}:{int(enable_tta)}:{digest}"
+    
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """Get a cached embedding, or None on a miss."""
+        with self._lock:
+            embedding = self._memory.get(key)
+            if embedding is not None or self._conn is None:
+                return embedding
+            
+            row = self._conn.execute(
+                "SELECT embedding FROM selfie_embeddings WHERE hash = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            
+            embedding = np.frombuffer(row[0], dtype=np.float32)
+            self._memory[key] = embedding
+            return embedding
+    
+    def put(self, key: str, embedding: np.ndarray):
+        """Store an embedding (memory and disk)."""
+        embedding = np.asarray(embedding, dtype=np.float32)
+        with self._lock:
+            self._memory[key] = embedding
+            if self._conn is None:
+                return
+            try:
+                with self._conn:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO selfie_embeddings (hash, embedding, dim, ts) VALUES (?, ?, ?, ?)",
+                        (key, embedding.tobytes(), embedding.shape[0], int(time.time()))
+                    )
+            except sqlite3.Error as e:
+                logger.warning(f"Failed to persist selfie embedding: {e}")
+
+
+# Global instance
+_selfie_cache = None
+
+
+def get_selfie_cache() -> SelfieEmbeddingCache:
+    """Get or create the shared selfie embedding cache."""
+    global _selfie_cache
+    if _selfie_cache is None:
+        _selfie_cache = SelfieEmbeddingCache()
+    return _selfie_cache
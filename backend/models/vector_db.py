@@ -9,14 +9,42 @@ FAISS (Facebook AI Similarity Search) provides:
 - Production-grade performance
 """
 
+import os
+import threading
 import numpy as np
 import faiss
 import pickle
-from typing import List, Tuple, Optional, Dict
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import List, Tuple, Optional, Dict, Set, Union
 from pathlib import Path
 import config
 
 
+# Shared GPU memory/stream pool for all rooms (created on first GPU search)
+_gpu_resources = None
+_gpu_lock = threading.Lock()
+
+
+def _gpu_available() -> bool:
+    """True when this FAISS build has GPU support and a device is visible."""
+    return (
+        config.FAISS_USE_GPU
+        and hasattr(faiss, 'StandardGpuResources')
+        and faiss.get_num_gpus() > 0
+    )
+
+
+@dataclass
+class FaceRecord:
+    """Per-face metadata collected during upload (slotted: no per-instance dict)."""
+    __slots__ = ('filename', 'face_index', 'timestamp', 'location')
+    filename: str
+    face_index: int
+    timestamp: Optional[str]
+    location: Optional[str]
+
+
 class FaceVectorDB:
     """
     FAISS-based vector database for face embeddings.
@@ -41,12 +69,21 @@ class FaceVectorDB:
         
         # IVF configuration for large datasets
         self.use_ivf = True  # Enable IVF for better performance
-        self.nlist = 100  # Number of clusters (sqrt of expected dataset size)
-        self.nprobe = 10  # Number of clusters to search (accuracy vs speed tradeoff)
+        self.nlist = 100  # Minimum number of clusters (grows with sqrt of dataset size)
+        self.nprobe = 16  # Number of clusters to search (accuracy vs speed tradeoff)
+        self.ivf_encoding = config.FAISS_IVF_ENCODING  # "Flat", "PQ64x8", ...
         
         # Metadata storage
         self.metadata = []
         
+        # Bulk mode: defer persistence until the outermost bulk_mode() exits
+        self._bulk_depth = 0
+        self._dirty = False
+        
+        # GPU replica of self.index for searches; rebuilt lazily after changes
+        self._use_gpu = _gpu_available()
+        self._gpu_index = None
+        
         # Load existing index
         self._load_index()
         
@@ -92,18 +129,33 @@ class FaceVectorDB:
         """Create appropriate FAISS index based on configuration."""
         if self.use_ivf and len(self.metadata) > 1000:
             # Use IVF index for large datasets (>1000 embeddings)
-            print(f"Creating IVF index with {self.nlist} clusters for large dataset")
-            quantizer = faiss.IndexFlatIP(self.embedding_dim)
-            index = faiss.IndexIVFFlat(quantizer, self.embedding_dim, self.nlist)
-            index.nprobe = self.nprobe
-            return index
+            return self._create_ivf_index(len(self.metadata))
         else:
             # Use flat index for small datasets
             print(f"Creating flat index for small dataset")
             return faiss.IndexFlatIP(self.embedding_dim)
     
-    def _save_index(self):
-        """Save FAISS index and metadata to disk."""
+    def _create_ivf_index(self, dataset_size: int):
+        """
+        Create an (untrained) IVF index sized for the dataset.
+        
+        Args:
+            dataset_size: Number of embeddings the index will hold
+        """
+        nlist = max(self.nlist, int(np.sqrt(dataset_size)))
+        description = f"IVF{nlist},{self.ivf_encoding}"
+        print(f"Creating IVF index {description} for large dataset")
+        index = faiss.index_factory(self.embedding_dim, description, faiss.METRIC_INNER_PRODUCT)
+        faiss.extract_index_ivf(index).nprobe = self.nprobe
+        return index
+    
+    def _save_index(self, fsync: bool = False):
+        """
+        Save FAISS index and metadata to disk.
+        
+        Args:
+            fsync: Force both files to stable storage before returning
+        """
         try:
             # Save FAISS index
             faiss.write_index(self.index, str(self.index_path))
@@ -111,12 +163,89 @@ class FaceVectorDB:
             # Save metadata
             with open(self.metadata_path, 'wb') as f:
                 pickle.dump(self.metadata, f)
+                if fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
             
+            if fsync:
+                fd = os.open(self.index_path, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+            
+            self._dirty = False
             print(f"[VECTOR_DB] Persisted {self.index.ntotal} embeddings to {self.index_path}")
                 
         except Exception as e:
             print(f"[VECTOR_DB] ERROR saving index: {e}")
     
+    def _get_gpu_index(self):
+        """
+        Get the GPU copy of the index, cloning it from the CPU index if stale.
+        
+        Returns:
+            The GPU index, or None when GPU search is unavailable
+        """
+        global _gpu_resources
+        if not self._use_gpu:
+            return None
+        
+        if self._gpu_index is None:
+            try:
+                with _gpu_lock:
+                    if _gpu_resources is None:
+                        _gpu_resources = faiss.StandardGpuResources()
+                options = faiss.GpuClonerOptions()
+                options.useFloat16 = True  # needed for large PQ lookup tables
+                gpu_index = faiss.index_cpu_to_gpu(_gpu_resources, 0, self.index, options)
+                if hasattr(gpu_index, 'nprobe'):
+                    gpu_index.nprobe = self.nprobe
+                self._gpu_index = gpu_index
+                print(f"[VECTOR_DB] Cloned index to GPU ({self.index.ntotal} embeddings)")
+            except Exception as e:
+                print(f"[VECTOR_DB] GPU index unavailable, searching on CPU: {e}")
+                self._use_gpu = False
+                return None
+        
+        return self._gpu_index
+    
+    def _persist(self):
+        """Save to disk now, or defer to the end of the active bulk_mode() block."""
+        # The index changed: the GPU copy is re-cloned on the next search
+        self._gpu_index = None
+        if self._bulk_depth > 0:
+            self._dirty = True
+        else:
+            self._save_index()
+    
+    def begin_bulk(self):
+        """Start deferring index writes (see bulk_mode)."""
+        self._bulk_depth += 1
+    
+    def commit_bulk(self):
+        """Stop deferring index writes; flush once if anything changed."""
+        if self._bulk_depth == 0:
+            return
+        self._bulk_depth -= 1
+        if self._bulk_depth == 0 and self._dirty:
+            self._save_index(fsync=True)
+    
+    @contextmanager
+    def bulk_mode(self):
+        """
+        Batch many inserts into a single write_index + fsync.
+        
+        Inside the block add_face/add_faces_batch only update the in-memory
+        index; the index and metadata are written once on exit (also on error,
+        so faces added before a failure are not lost). Blocks may be nested.
+        """
+        self.begin_bulk()
+        try:
+            yield self
+        finally:
+            self.commit_bulk()
+    
     def add_face(
         self,
         embedding: np.ndarray,
@@ -164,8 +293,8 @@ class FaceVectorDB:
         # Add metadata
         self.metadata.append(face_metadata)
         
-        # Save to disk
-        self._save_index()
+        # Save to disk (deferred inside bulk_mode)
+        self._persist()
         
         # Return ID (index position)
         return str(len(self.metadata) - 1)
@@ -175,7 +304,7 @@ class FaceVectorDB:
         embeddings: List[np.ndarray],
         photo_paths: List[str],
         bboxes: List[Tuple[int, int, int, int]],
-        metadata_list: Optional[List[Dict]] = None
+        metadata_list: Optional[List[Union[Dict, FaceRecord]]] = None
     ) -> List[str]:
         """
         Add multiple face embeddings in batch (more efficient).
@@ -184,7 +313,7 @@ class FaceVectorDB:
             embeddings: List of face embeddings
             photo_paths: List of photo paths
             bboxes: List of bounding boxes
-            metadata_list: Optional list of metadata dicts
+            metadata_list: Optional list of metadata dicts or FaceRecords
             
         Returns:
             List of unique IDs
@@ -192,10 +321,9 @@ class FaceVectorDB:
         if not embeddings:
             return []
         
-        # Normalize all embeddings
+        # Normalize all embeddings (in place on the fresh array; unit rows are unchanged)
         embeddings_array = np.array(embeddings, dtype=np.float32)
-        norms = np.linalg.norm(embeddings_array, axis=1, keepdims=True)
-        embeddings_array = embeddings_array / (norms + 1e-7)
+        faiss.normalize_L2(embeddings_array)
         
         # Check if we need to upgrade to IVF index
         current_size = self.index.ntotal
@@ -203,23 +331,22 @@ class FaceVectorDB:
         
         if self.use_ivf and new_size > 1000 and isinstance(self.index, faiss.IndexFlatIP):
             print(f"[VECTOR_DB] Upgrading to IVF index (dataset size: {new_size})")
-            # Collect all existing embeddings
-            all_embeddings = []
+            # Carry existing embeddings over (flat indexes store raw vectors)
+            existing = None
             if current_size > 0:
-                # Extract existing embeddings (this is a limitation - we need to store them)
-                # For now, we'll just rebuild with new embeddings
-                print(f"[VECTOR_DB] Warning: Cannot extract existing embeddings from flat index")
-                print(f"[VECTOR_DB] Creating new IVF index - existing {current_size} embeddings will be lost")
-                print(f"[VECTOR_DB] To avoid this, re-import all photos after this upgrade")
+                existing = self.index.reconstruct_n(0, current_size)
+                train_data = np.vstack([existing, embeddings_array])
+            else:
+                train_data = embeddings_array
             
             # Create new IVF index
-            quantizer = faiss.IndexFlatIP(self.embedding_dim)
-            new_index = faiss.IndexIVFFlat(quantizer, self.embedding_dim, self.nlist)
-            new_index.nprobe = self.nprobe
+            new_index = self._create_ivf_index(new_size)
             
-            # Train on new embeddings
-            print(f"[VECTOR_DB] Training IVF index on {len(embeddings)} embeddings...")
-            new_index.train(embeddings_array)
+            # Train on existing + new embeddings
+            print(f"[VECTOR_DB] Training IVF index on {len(train_data)} embeddings...")
+            new_index.train(train_data)
+            if existing is not None:
+                new_index.add(existing)
             
             self.index = new_index
             print(f"[VECTOR_DB] IVF index created and trained")
@@ -235,11 +362,18 @@ class FaceVectorDB:
             }
             
             if metadata_list and i < len(metadata_list):
-                for key, value in metadata_list[i].items():
-                    if isinstance(value, (np.integer, np.floating)):
-                        face_metadata[key] = float(value) if isinstance(value, np.floating) else int(value)
-                    else:
-                        face_metadata[key] = value
+                extra = metadata_list[i]
+                if isinstance(extra, FaceRecord):
+                    face_metadata["filename"] = extra.filename
+                    face_metadata["face_index"] = extra.face_index
+                    face_metadata["timestamp"] = extra.timestamp
+                    face_metadata["location"] = extra.location
+                else:
+                    for key, value in extra.items():
+                        if isinstance(value, (np.integer, np.floating)):
+                            face_metadata[key] = float(value) if isinstance(value, np.floating) else int(value)
+                        else:
+                            face_metadata[key] = value
             
             self.metadata.append(face_metadata)
         
@@ -253,10 +387,8 @@ class FaceVectorDB:
         
         print(f"[VECTOR_DB] Added {len(embeddings)} embeddings to index (total: {self.index.ntotal})")
         
-        # Save to disk
-        self._save_index()
-        
-        print(f"[VECTOR_DB] Saved index to disk: {self.index_path}")
+        # Save to disk (deferred inside bulk_mode)
+        self._persist()
         
         # Return IDs
         start_id = len(self.metadata) - len(embeddings)
@@ -283,20 +415,26 @@ class FaceVectorDB:
             return []
         
         try:
-            # Normalize query embedding
-            query_embedding = np.array(query_embedding, dtype=np.float32)
+            # Normalize query embedding (no copy when already float32). FaceNet
+            # output is already unit length, so usually there's nothing to do
+            query_embedding = np.asarray(query_embedding, dtype=np.float32)
             norm = np.linalg.norm(query_embedding)
-            if norm > 0:
+            if norm > 0 and abs(norm - 1.0) > 1e-5:
                 query_embedding = query_embedding / norm
             
-            # Search FAISS index
+            # Search FAISS index (the GPU copy when available)
             # Inner product with normalized vectors = cosine similarity
-            similarities, indices = self.index.search(query_embedding.reshape(1, -1), min(top_k, self.index.ntotal))
+            index = self._get_gpu_index()
+            if index is None:
+                index = self.index
+            similarities, indices = index.search(
+                np.ascontiguousarray(query_embedding.reshape(1, -1)), min(top_k, self.index.ntotal)
+            )
             
-            # Filter by threshold and prepare results
+            # Filter by threshold and prepare results (-1 marks an empty slot)
             results = []
             for similarity, idx in zip(similarities[0], indices[0]):
-                if similarity >= similarity_threshold and idx < len(self.metadata):
+                if similarity >= similarity_threshold and 0 <= idx < len(self.metadata):
                     result = self.metadata[idx].copy()
                     
                     # Reconstruct bbox if fields exist
@@ -329,11 +467,14 @@ class FaceVectorDB:
     def get_count(self) -> int:
         """Get total number of face embeddings."""
         return self.index.ntotal
-    
+
+    def get_photo_paths(self) -> Set[str]:
+        """Get the paths of all photos with at least one indexed face."""
+        return {meta['photo_path'] for meta in self.metadata}
+
     def delete_by_photo(self, photo_path: str) -> int:
         """
         Delete all faces from a specific photo.
-        Note: FAISS doesn't support deletion, so we rebuild the index.
         
         Args:
             photo_path: Path to the photo
@@ -341,35 +482,46 @@ class FaceVectorDB:
         Returns:
             Number of faces deleted
         """
-        # Find indices to keep
-        indices_to_keep = []
-        metadata_to_keep = []
-        
-        for i, meta in enumerate(self.metadata):
-            if meta['photo_path'] != photo_path:
-                indices_to_keep.append(i)
-                metadata_to_keep.append(meta)
-        
-        deleted_count = len(self.metadata) - len(metadata_to_keep)
-        
-        if deleted_count > 0:
-            # Rebuild index with remaining embeddings
-            # This requires storing embeddings separately (not implemented for simplicity)
-            # For now, just update metadata (note: index will be out of sync strictly speaking without rebuilding)
-            # In a real FAISS system with deletion, we would use IDMap or rebuild.
-            # Since we don't store raw embeddings, we can't rebuild the index easily without reloading vectors.
-            # But for this simple version, we'll accept that the index grows until reset.
-            # Ideally we should use index.remove_ids but IndexFlatIP doesn't support it directly without IDMap.
-            
-            # Simple workaround: Reset index and clear metadata if we deleted something? No, that deletes everything.
-            # Better approach for now: Just mark metadata as deleted and filter in search.
-            # Or simplified: Just accept we can't delete individual vectors from IndexFlat easily without IDs.
-            # We'll rely on reset() for cleanup.
-            
-            # But return the count anyway to satisfy the API
-            pass
+        return self.delete_by_photos([photo_path])
+    
+    def delete_by_photos(self, photo_paths: List[str]) -> int:
+        """
+        Delete all faces from several photos with a single index mutation.
+        
+        Args:
+            photo_paths: Paths of the photos to remove
             
-        return deleted_count
+        Returns:
+            Number of faces deleted
+        """
+        targets = {str(p) for p in photo_paths}
+        remove_ids = [i for i, meta in enumerate(self.metadata) if meta['photo_path'] in targets]
+        
+        if not remove_ids:
+            return 0
+        
+        if isinstance(self.index, faiss.IndexIVF):
+            # IVF keeps the original labels after remove_ids, so rebuild the
+            # inverted lists from the surviving vectors to keep ids == positions
+            removed = set(remove_ids)
+            keep_ids = [i for i in range(self.index.ntotal) if i not in removed]
+            self.index.make_direct_map()
+            kept_vectors = self.index.reconstruct_n(0, self.index.ntotal)[keep_ids]
+            self.index.reset()
+            if len(kept_vectors):
+                self.index.add(kept_vectors)
+        else:
+            # Flat index compacts in place, preserving the order of the rest
+            self.index.remove_ids(np.array(remove_ids, dtype=np.int64))
+        
+        self.metadata = [meta for meta in self.metadata if meta['photo_path'] not in targets]
+        
+        print(f"[VECTOR_DB] Deleted {len(remove_ids)} embeddings from {len(targets)} photo(s) (total: {self.index.ntotal})")
+        
+        # Save to disk (deferred inside bulk_mode)
+        self._persist()
+        
+        return len(remove_ids)
     
     def reset(self) -> bool:
         """
@@ -381,6 +533,7 @@ class FaceVectorDB:
         try:
             self.index = faiss.IndexFlatIP(self.embedding_dim)
             self.metadata = []
+            self._gpu_index = None
             self._save_index()
             print("FAISS database reset")
             return True
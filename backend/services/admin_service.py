@@ -4,25 +4,37 @@ Handles bulk photo uploads and face extraction pipeline.
 """
 
 import os
+import threading
 from pathlib import Path
 from typing import List, Dict
 import asyncio
 from concurrent.futures import ThreadPoolExecutor
 
+import numpy as np
+
 from models.face_detection import FaceDetector
 from models.face_recognition import get_facenet_model
-from models.vector_db import get_vector_db
+from models.vector_db import get_vector_db, FaceRecord
 from models.location_db import get_location_db
+from models.processed_files import get_processed_file_index
 from utils.image_processing import (
     load_image,
-    crop_face,
-    preprocess_face,
+    crop_faces,
+    preprocess_faces_batch,
     save_image
 )
 from utils.exif_extractor import EXIFExtractor
 import config
 
 
+# Set once the shared models have run their first (warm-up) inference
+_models_warm = threading.Event()
+_warmup_lock = threading.Lock()
+_warmup_thread = None
+# Serializes model inference and index/location writes when several images
+# are processed concurrently; loading and EXIF parsing still overlap
+_inference_lock = threading.Lock()
+
 
 class AdminService:
     """Service for admin operations (photo uploads and processing)."""
@@ -33,10 +45,12 @@ class AdminService:
         # Models are stateless/shared
         self.face_detector = FaceDetector()
         self.face_recognizer = get_facenet_model()
+        self.enable_tta = config.ENABLE_TTA
         
         # Databases are stateful (per room)
         self.vector_db = get_vector_db(room_id)
         self.location_db = get_location_db(room_id)
+        self.processed_files = get_processed_file_index(room_id)
         
         # Helper to get upload dir
         if room_id:
@@ -48,6 +62,32 @@ class AdminService:
             self.upload_dir = config.UPLOAD_DIR
             
         self.executor = ThreadPoolExecutor(max_workers=4)
+        
+        # Pay graph building / kernel selection off the request path
+        self._start_warmup()
+
+    def _start_warmup(self):
+        """Run a dummy forward pass through both models in a background thread (once per process)."""
+        global _warmup_thread
+        with _warmup_lock:
+            if _warmup_thread is None:
+                _warmup_thread = threading.Thread(target=self._warm_up_models, name="model-warmup", daemon=True)
+                _warmup_thread.start()
+
+    def _warm_up_models(self):
+        """Trigger first-inference setup (graph tracing, cuDNN autotune) on zero inputs."""
+        try:
+            print("[UPLOAD] Warming up face models...")
+            self.face_detector.detect_faces(np.zeros((160, 160, 3), np.uint8))
+            self.face_recognizer.generate_embedding(
+                np.zeros((config.FACE_SIZE, config.FACE_SIZE, 3), np.float32),
+                enable_tta=self.enable_tta
+            )
+            print("[UPLOAD] ✓ Face models warmed up")
+        except Exception as e:
+            print(f"[UPLOAD] Model warm-up failed: {e}")
+        finally:
+            _models_warm.set()
 
     async def _process_single_photo(self, filename: str, file_bytes: bytes) -> Dict:
         """Process a single uploaded photo (writes to disk then processes)."""
@@ -68,15 +108,21 @@ class AdminService:
         print(f"[UPLOAD] ========================================\n")
         
         # Process photos ONE AT A TIME to avoid TensorFlow threading issues
-        for idx, (filename, file_bytes) in enumerate(files, 1):
-            print(f"[UPLOAD] Processing photo {idx}/{len(files)}: {filename}")
-            result = await self._process_single_photo(filename, file_bytes)
-            results.append(result)
+        # The FAISS index is written to disk once at the end of the batch
+        with self.vector_db.bulk_mode():
+            for idx, (filename, file_bytes) in enumerate(files, 1):
+                print(f"[UPLOAD] Processing photo {idx}/{len(files)}: {filename}")
+                result = await self._process_single_photo(filename, file_bytes)
+                results.append(result)
         
-        # Aggregate stats
-        successful = sum(1 for r in results if r['success'])
-        failed = len(results) - successful
-        total_faces = sum(r.get('faces_detected', 0) for r in results if r['success'])
+        # Aggregate stats (single pass)
+        successful = failed = total_faces = 0
+        for r in results:
+            if r['success']:
+                successful += 1
+                total_faces += r.get('faces_detected', 0)
+            else:
+                failed += 1
         
         print(f"\n[UPLOAD] ========================================")
         print(f"[UPLOAD] Bulk upload complete!")
@@ -105,6 +151,8 @@ class AdminService:
     def _sync_process_image(self, photo_path: Path) -> Dict:
         """Synchronous image processing logic (runs in thread pool)."""
         filename = photo_path.name
+        # Models are not thread-safe: don't race the warm-up inference
+        _models_warm.wait()
         print(f"\n[UPLOAD] ========== Processing: {filename} ==========")
         
         try:
@@ -120,59 +168,60 @@ class AdminService:
             print(f"[UPLOAD] Step 2/5: Extracting EXIF metadata...")
             metadata = EXIFExtractor.extract_metadata(str(photo_path))
             
-            # Store in Location DB if available
-            if metadata.get('has_location'):
-                print(f"[UPLOAD] ✓ GPS found: {metadata['latitude']:.4f}, {metadata['longitude']:.4f}")
-                self.location_db.add_location(photo_path.name, metadata)
-            else:
-                print(f"[UPLOAD] ℹ No GPS data in photo")
+            with _inference_lock:
+                # Store in Location DB if available
+                if metadata.get('has_location'):
+                    print(f"[UPLOAD] ✓ GPS found: {metadata['latitude']:.4f}, {metadata['longitude']:.4f}")
+                    self.location_db.add_location(photo_path.name, metadata)
+                else:
+                    print(f"[UPLOAD] ℹ No GPS data in photo")
 
-            # 3. Detect Faces
-            print(f"[UPLOAD] Step 3/5: Detecting faces...")
-            faces = self.face_detector.detect_faces(image)
+                # 3. Detect Faces
+                print(f"[UPLOAD] Step 3/5: Detecting faces...")
+                faces = self.face_detector.detect_faces(image)
             
-            if not faces:
-                print(f"[UPLOAD] ⚠ No faces detected in this photo")
-                return {
-                    'filename': filename,
-                    'success': True,
-                    'faces_detected': 0
-                }
+                if not faces:
+                    print(f"[UPLOAD] ⚠ No faces detected in this photo")
+                    return {
+                        'filename': filename,
+                        'success': True,
+                        'faces_detected': 0
+                    }
             
-            print(f"[UPLOAD] ✓ Found {len(faces)} face(s)")
+                print(f"[UPLOAD] ✓ Found {len(faces)} face(s)")
             
-            processed_faces = 0
-            # 4. Process each face
-            for i, (bbox, confidence) in enumerate(faces):
-                print(f"[UPLOAD] Step 4/5: Processing face {i+1}/{len(faces)} (confidence: {confidence:.2f})...")
-                
-                face_img = crop_face(image, bbox)
-                preprocessed = preprocess_face(face_img, config.FACE_SIZE)
-                
-                # 5. Generate Embedding
-                print(f"[UPLOAD] Step 5/5: Generating embedding for face {i+1}... (this takes ~10-15s)")
-                embedding = self.face_recognizer.generate_embedding(preprocessed)
+                # 4. Process each face (embeddings are stored in one batch below)
+                timestamp = metadata.get('timestamp')
+                location = metadata.get('location_name')
+                embeddings, bboxes, records = [], [], []
+                print(f"[UPLOAD] Step 4/5: Preprocessing {len(faces)} face(s)...")
+                preprocessed_faces = preprocess_faces_batch(
+                    crop_faces(image, [bbox for bbox, _ in faces]),
+                    config.FACE_SIZE
+                )
+                for i, ((bbox, confidence), preprocessed) in enumerate(zip(faces, preprocessed_faces)):
+                    # 5. Generate Embedding
+                    print(f"[UPLOAD] Step 5/5: Generating embedding for face {i+1}/{len(faces)} (confidence: {confidence:.2f})... (this takes ~10-15s)")
+                    embedding = self.face_recognizer.generate_embedding(preprocessed, enable_tta=self.enable_tta)
                 
-                if embedding is not None:
-                    print(f"[UPLOAD] ✓ Embedding generated (dim: {len(embedding)})")
-                    
-                    # 6. Store in Vector DB
-                    print(f"[UPLOAD] Storing in database...")
-                    self.vector_db.add_face(
-                        embedding=embedding,
-                        photo_path=str(photo_path),
-                        bbox=bbox,
-                        metadata={
-                            "filename": filename,
-                            "face_index": i,
-                            "timestamp": metadata.get('timestamp'),
-                            "location": metadata.get('location_name')
-                        }
+                    if embedding is not None:
+                        print(f"[UPLOAD] ✓ Embedding generated (dim: {len(embedding)})")
+                        embeddings.append(embedding)
+                        bboxes.append(bbox)
+                        records.append(FaceRecord(filename, i, timestamp, location))
+                    else:
+                        print(f"[UPLOAD] ❌ Failed to generate embedding for face {i+1}")
+            
+                # 6. Store in Vector DB
+                processed_faces = len(embeddings)
+                if embeddings:
+                    print(f"[UPLOAD] Storing {processed_faces} face(s) in database...")
+                    self.vector_db.add_faces_batch(
+                        embeddings=embeddings,
+                        photo_paths=[str(photo_path)] * processed_faces,
+                        bboxes=bboxes,
+                        metadata_list=records
                     )
-                    processed_faces += 1
-                    print(f"[UPLOAD] ✓ Face {i+1} stored successfully")
-                else:
-                    print(f"[UPLOAD] ❌ Failed to generate embedding for face {i+1}")
 
             print(f"[UPLOAD] ========== ✓ Completed: {filename} ({processed_faces} faces) ==========\n")
             return {
@@ -194,9 +243,9 @@ class AdminService:
         # Count actual photo files in THIS room's upload dir
         photo_count = 0
         if self.upload_dir.exists():
-            for file in self.upload_dir.iterdir():
-                if file.is_file() and file.name != '.gitkeep':
-                    photo_count += 1
+            # scandir reports the file type from the directory listing (no stat per file)
+            with os.scandir(self.upload_dir) as entries:
+                photo_count = sum(1 for e in entries if e.is_file() and e.name != '.gitkeep')
         
         return {
             'total_faces': total_faces,
@@ -223,6 +272,9 @@ class AdminService:
         try:
             # Delete from vector database (it matches by path string)
             faces_deleted = self.vector_db.delete_by_photo(photo_path_str)
+            self.processed_files.delete_by_photos([photo_path_str])
+            # Location rows are keyed by filename
+            self.location_db.delete_by_photo(Path(photo_path_str).name)
             
             # Delete file
             path = Path(photo_path_str)
@@ -240,19 +292,47 @@ class AdminService:
         except Exception as e:
             return {'success': False, 'error': str(e)}
 
+    def delete_photos_batch(self, paths: List[str]) -> Dict:
+        """
+        Delete several photos and their embeddings.
+        The vector database is rewritten once for the whole batch.
+        """
+        try:
+            faces_deleted = self.vector_db.delete_by_photos(paths)
+            self.processed_files.delete_by_photos(paths)
+            self.location_db.delete_by_photos([Path(p).name for p in paths])
+            
+            files_deleted = 0
+            for path in map(Path, paths):
+                if path.exists():
+                    path.unlink()
+                    files_deleted += 1
+            
+            return {
+                'success': True,
+                'faces_deleted': faces_deleted,
+                'files_deleted': files_deleted
+            }
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+
     def reset_database(self) -> Dict:
         try:
             # Reset FAISS
             success = self.vector_db.reset() # This resets the instance we hold (room specific)
             if not success: return {'success': False}
+            self.processed_files.reset()
+            self.location_db.reset()
             
             # Delete photos in this room
-            photos_deleted = 0
+            photos = []
             if self.upload_dir.exists():
-                for file in self.upload_dir.iterdir():
-                    if file.name != '.gitkeep' and file.is_file():
-                        file.unlink()
-                        photos_deleted += 1
+                with os.scandir(self.upload_dir) as entries:
+                    photos = [e.path for e in entries if e.name != '.gitkeep' and e.is_file()]
+            result = self.delete_photos_batch(photos)
+            if not result['success']:
+                return result
+            photos_deleted = result['files_deleted']
             
             # We don't delete selfies here as they might be global or per-session
             
@@ -4,21 +4,167 @@ Uses Groq AI to understand natural language queries and search photos.
 """
 
 import os
+import re
 import json
+import time
 import uuid
-from typing import Dict, List, Optional, Tuple
-from datetime import datetime, timedelta
-from dateutil import parser as date_parser
+import sqlite3
+import asyncio
+import threading
+from functools import lru_cache
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from calendar import monthrange
+from cachetools import TTLCache
 import logging
 
+import numpy as np
+
 from models.vector_db import get_vector_db
 from models.location_db import get_location_db
-from utils.exif_extractor import EXIFExtractor
+from utils.exif_extractor import EXIFExtractor, parse_exif_timestamp
+from utils.redis_client import get_redis
+import config
 
 logger = logging.getLogger(__name__)
 
-# Session storage (in-memory for now, use Redis for production)
+# Session storage: Redis hashes with a TTL when REDIS_URL is set,
+# otherwise an in-process dict (only valid for a single worker)
 _sessions = {}
+_SESSION_TTL = timedelta(minutes=config.SESSION_TIMEOUT_MINUTES)
+_SESSION_KEY = "pixelmatch:session:{}"
+
+# Groq result caches: repeated queries skip the network round-trip
+_AI_CACHE_TTL = int(os.getenv("AI_CACHE_TTL_SECONDS", 3600))
+_parse_cache = TTLCache(maxsize=1024, ttl=_AI_CACHE_TTL)
+_response_cache = TTLCache(maxsize=1024, ttl=_AI_CACHE_TTL)
+_cache_lock = threading.Lock()
+
+# Faces fetched for "show all" (also the candidate pool the criteria filters run on)
+_SHOW_ALL_TOP_K = 500
+
+# Write-through sqlite copy of _parse_cache; the most recent entries are
+# preloaded on startup so a restart doesn't send every query back to Groq
+_PARSE_STORE_PRELOAD = 512
+_parse_store = None
+_parse_store_lock = threading.Lock()
+
+# Simple (non-AI) parser tables, built once at import
+_MONTHS = {
+    'january': 1, 'jan': 1,
+    'february': 2, 'feb': 2,
+    'march': 3, 'mar': 3,
+    'april': 4, 'apr': 4,
+    'may': 5,
+    'june': 6, 'jun': 6,
+    'july': 7, 'jul': 7,
+    'august': 8, 'aug': 8,
+    'september': 9, 'sept': 9, 'sep': 9,
+    'october': 10, 'oct': 10,
+    'november': 11, 'nov': 11,
+    'december': 12, 'dec': 12
+}
+_YEAR_RE = re.compile(r'20\d{2}')
+# Longest names first so "september" wins over "sep"
+_MONTH_RE = re.compile(r'\b(' + '|'.join(sorted(_MONTHS, key=len, reverse=True)) + r')\b')
+_KEYWORD_RE = re.compile(r'\b(beach|party|wedding|birthday|vacation|trip)(?:e?s)?\b')
+_SHOW_ALL_RE = re.compile(r'all photos|all my photos|everything|show all')
+# Whole queries answered straight from the face search (no Groq calls)
+_SHOW_ALL_PHRASES = frozenset({
+    'all', 'all photos', 'all my photos', 'everything', 'show all',
+    'show all photos', 'show all my photos', 'show me all my photos',
+    'show everything', 'show me everything'
+})
+
+# One pooled HTTP/2 connection set shared by every room's Groq client, so the
+# parse and reply calls reuse a warm TLS connection
+_groq_http_client = None
+
+
+def _get_groq_http_client():
+    """Get the shared keep-alive httpx client used for Groq requests."""
+    global _groq_http_client
+    with _cache_lock:
+        if _groq_http_client is None:
+            import httpx
+            _groq_http_client = httpx.Client(
+                http2=True,
+                limits=httpx.Limits(max_keepalive_connections=32, max_connections=64, keepalive_expiry=30)
+            )
+    return _groq_http_client
+
+
+def _get_parse_store() -> Optional[sqlite3.Connection]:
+    """Open the on-disk parse cache (once per process) and preload it into _parse_cache."""
+    global _parse_store
+    with _parse_store_lock:
+        if _parse_store is not None:
+            return _parse_store or None
+        try:
+            conn = sqlite3.connect(str(config.AI_PARSE_CACHE_DB), check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS parse_cache ("
+                "query TEXT, locations TEXT, criteria TEXT, ts REAL, "
+                "PRIMARY KEY (query, locations))"
+            )
+            rows = conn.execute(
+                "SELECT query, locations, criteria FROM parse_cache WHERE ts > ? ORDER BY ts DESC LIMIT ?",
+                (time.time() - _AI_CACHE_TTL, _PARSE_STORE_PRELOAD)
+            ).fetchall()
+            with _cache_lock:
+                for query, locations, criteria in rows:
+                    _parse_cache[(query, tuple(json.loads(locations)))] = _decode_criteria(criteria)
+            logger.info(f"Loaded {len(rows)} cached query parses from {config.AI_PARSE_CACHE_DB}")
+            _parse_store = conn
+        except Exception as e:
+            logger.error(f"Failed to open parse cache database: {e}")
+            _parse_store = False
+        return _parse_store or None
+
+
+def _decode_criteria(raw: str) -> Dict:
+    """Rebuild a criteria dict from its stored JSON (date_range back to a tuple)."""
+    criteria = json.loads(raw)
+    criteria['date_range'] = tuple(criteria['date_range'])
+    return criteria
+
+
+def _load_stored_parse(cache_key: Tuple[str, Tuple[str, ...]]) -> Optional[Dict]:
+    """Look up a parse that is in the sqlite store but not (or no longer) in memory."""
+    store = _get_parse_store()
+    if store is None:
+        return None
+    query, locations = cache_key
+    with _parse_store_lock:
+        row = store.execute(
+            "SELECT criteria FROM parse_cache WHERE query = ? AND locations = ? AND ts > ?",
+            (query, json.dumps(locations), time.time() - _AI_CACHE_TTL)
+        ).fetchone()
+    return _decode_criteria(row[0]) if row else None
+
+
+def _store_parse(cache_key: Tuple[str, Tuple[str, ...]], criteria: Dict):
+    """Write a fresh parse through to the sqlite store."""
+    store = _get_parse_store()
+    if store is None:
+        return
+    query, locations = cache_key
+    try:
+        with _parse_store_lock, store:
+            store.execute(
+                "INSERT OR REPLACE INTO parse_cache (query, locations, criteria, ts) VALUES (?, ?, ?, ?)",
+                (query, json.dumps(locations), json.dumps(criteria), time.time())
+            )
+    except sqlite3.Error as e:
+        logger.warning(f"Failed to persist query parse: {e}")
+
+
+@lru_cache(maxsize=4096)
+def _exif_timestamp(photo_path: str, mtime: float) -> Optional[str]:
+    """EXIF timestamp of a photo; keyed by mtime so a replaced file is re-read."""
+    return EXIFExtractor.extract_metadata(photo_path).get('timestamp')
 
 
 class AISearchService:
@@ -30,10 +176,15 @@ class AISearchService:
         self.vector_db = get_vector_db(room_id)
         self.location_db = get_location_db(room_id)
         
+        # Warm the query-parse cache from disk
+        _get_parse_store()
+        
         # Initialize Groq client (lazy loading)
         self.groq_client = None
         self.groq_api_key = os.getenv("GROQ_API_KEY", "")
-        self.ai_model = os.getenv("AI_MODEL", "llama-3.3-70b-versatile")
+        # Small, fast model for structured query parsing; larger one for phrasing replies
+        self.ai_model_parse = os.getenv("AI_MODEL_PARSE", "llama-3.1-8b-instant")
+        self.ai_model_respond = os.getenv("AI_MODEL_RESPOND", os.getenv("AI_MODEL", "llama-3.3-70b-versatile"))
         
         logger.info("AI Search Service initialized")
     
@@ -42,7 +193,7 @@ class AISearchService:
         if self.groq_client is None and self.groq_api_key and self.groq_api_key != "your_groq_api_key_here":
             try:
                 from groq import Groq
-                self.groq_client = Groq(api_key=self.groq_api_key)
+                self.groq_client = Groq(api_key=self.groq_api_key, http_client=_get_groq_http_client())
                 logger.info("Groq AI client initialized")
             except ImportError:
                 logger.error("Groq library not installed. Run: pip install groq")
@@ -50,7 +201,7 @@ class AISearchService:
                 logger.error(f"Failed to initialize Groq client: {e}")
         return self.groq_client
     
-    def create_session(self, face_embedding: List[float], selfie_filename: str) -> str:
+    def create_session(self, face_embedding: np.ndarray, selfie_filename: str) -> str:
         """
         Create a search session with user's face embedding.
         
@@ -62,31 +213,80 @@ class AISearchService:
             Session ID
         """
         session_id = str(uuid.uuid4())
-        
-        _sessions[session_id] = {
-            'face_embedding': face_embedding,
-            'selfie_filename': selfie_filename,
-            'created_at': datetime.now(),
-            'chat_history': []
-        }
+        created_at = datetime.now()
+        # Compact float32 vector: 4 bytes/dim instead of a list of Python floats
+        face_embedding = np.asarray(face_embedding, dtype=np.float32)
+        
+        redis_client = get_redis()
+        if redis_client is not None:
+            key = _SESSION_KEY.format(session_id)
+            pipe = redis_client.pipeline()
+            pipe.hset(key, mapping={
+                'face_embedding': face_embedding.tobytes(),
+                'selfie_filename': selfie_filename,
+                'created_at': created_at.isoformat(),
+                'chat_history': '[]'
+            })
+            pipe.expire(key, _SESSION_TTL)
+            pipe.execute()
+        else:
+            self._purge_expired_sessions(created_at)
+            _sessions[session_id] = {
+                'face_embedding': face_embedding,
+                'selfie_filename': selfie_filename,
+                'created_at': created_at,
+                'chat_history': []
+            }
         
         logger.info(f"Created session {session_id} for {selfie_filename}")
         return session_id
     
     def get_session(self, session_id: str) -> Optional[Dict]:
         """Get session data."""
+        redis_client = get_redis()
+        if redis_client is not None:
+            # Expiry is handled by the key TTL
+            data = redis_client.hgetall(_SESSION_KEY.format(session_id))
+            if not data:
+                return None
+            return {
+                'face_embedding': np.frombuffer(data[b'face_embedding'], dtype=np.float32),
+                'selfie_filename': data[b'selfie_filename'].decode(),
+                'created_at': datetime.fromisoformat(data[b'created_at'].decode()),
+                'chat_history': json.loads(data[b'chat_history'])
+            }
+        
         session = _sessions.get(session_id)
         
         if session:
             # Check timeout
-            timeout_minutes = int(os.getenv("SESSION_TIMEOUT_MINUTES", 30))
-            if datetime.now() - session['created_at'] > timedelta(minutes=timeout_minutes):
-                del _sessions[session_id]
+            if datetime.now() - session['created_at'] > _SESSION_TTL:
+                _sessions.pop(session_id, None)
                 logger.info(f"Session {session_id} expired")
                 return None
         
         return session
     
+    def _append_chat_history(self, session_id: str, session: Dict, entry: Dict):
+        """Record a chat turn on the session (written back to Redis when in use)."""
+        session['chat_history'].append(entry)
+        
+        redis_client = get_redis()
+        if redis_client is not None:
+            # HSET on an existing key keeps its TTL
+            redis_client.hset(
+                _SESSION_KEY.format(session_id),
+                'chat_history',
+                json.dumps(session['chat_history'])
+            )
+    
+    @staticmethod
+    def _purge_expired_sessions(now: datetime):
+        """Drop expired in-memory sessions so abandoned ones don't accumulate."""
+        expired = [sid for sid, s in _sessions.items() if now - s['created_at'] > _SESSION_TTL]
+        for sid in expired:
+            _sessions.pop(sid, None)
+    
     def parse_query_with_ai(self, user_query: str, available_locations: List[str]) -> Dict:
         """
         Use Groq AI to parse user's natural language query.
@@ -110,59 +310,52 @@ class AISearchService:
             logger.warning("Groq AI not available, using simple parsing")
             return self._simple_parse_query(user_query, available_locations)
         
-        # Build system prompt
+        cache_key = (user_query.lower().strip(), tuple(sorted(loc for loc in available_locations if loc)))
+        with _cache_lock:
+            cached = _parse_cache.get(cache_key)
+        if cached is None:
+            cached = _load_stored_parse(cache_key)
+            if cached is not None:
+                with _cache_lock:
+                    _parse_cache[cache_key] = cached
+        if cached is not None:
+            logger.info(f"AI parse cache hit: {cached}")
+            return dict(cached)
+        
+        # Build system prompt (kept minimal: prefill cost scales with input tokens)
         current_year = datetime.now().year
-        system_prompt = f"""You are a photo search assistant. Parse the user's query and extract search criteria.
-
-IMPORTANT: Current year is {current_year}. If user mentions a month without a year, assume {current_year}.
-
-Available photo locations: {', '.join([loc for loc in available_locations if loc]) if available_locations else 'None'}
-
-Extract:
-1. Location (if mentioned, match to available locations)
-2. Date/time range (if mentioned, convert to ISO format)
-3. Keywords (event types, activities, etc.)
-4. If user wants all photos (no specific criteria)
-
-Respond ONLY with valid JSON:
-{{
-    "location": "location name or null",
-    "date_start": "YYYY-MM-DD or null",
-    "date_end": "YYYY-MM-DD or null",
-    "keywords": ["keyword1", "keyword2"],
-    "show_all": true/false,
-    "confidence": 0.0-1.0
-}}"""
+        locs_csv = ','.join(loc for loc in available_locations if loc) or 'none'
+        system_prompt = (
+            f"Extract photo search JSON:{{location,date_start,date_end,keywords,show_all,confidence}}. "
+            f"Year={current_year}. Locs:{locs_csv}. Dates ISO, null if absent."
+        )
         
         try:
             response = client.chat.completions.create(
-                model=self.ai_model,
+                model=self.ai_model_parse,
                 messages=[
                     {"role": "system", "content": system_prompt},
                     {"role": "user", "content": user_query}
                 ],
-                temperature=0.1,  # Low temperature for consistent parsing
-                max_tokens=500
+                temperature=0,  # Deterministic parsing (also makes results cacheable)
+                max_tokens=180,  # The JSON schema never needs more than ~150 tokens
+                response_format={"type": "json_object"}  # API-enforced JSON, no fence stripping
             )
             
-            ai_response = response.choices[0].message.content.strip()
-            
-            # Extract JSON from response
-            if "```json" in ai_response:
-                ai_response = ai_response.split("```json")[1].split("```")[0].strip()
-            elif "```" in ai_response:
-                ai_response = ai_response.split("```")[1].split("```")[0].strip()
-            
-            parsed = json.loads(ai_response)
+            parsed = json.loads(response.choices[0].message.content)
             
             logger.info(f"AI parsed query: {parsed}")
-            return {
+            criteria = {
                 'location': parsed.get('location'),
                 'date_range': (parsed.get('date_start'), parsed.get('date_end')),
                 'keywords': parsed.get('keywords', []),
                 'show_all': parsed.get('show_all', False),
                 'confidence': parsed.get('confidence', 0.8)
             }
+            with _cache_lock:
+                _parse_cache[cache_key] = criteria
+            _store_parse(cache_key, criteria)
+            return dict(criteria)
             
         except Exception as e:
             logger.error(f"AI parsing failed: {e}, falling back to simple parsing")
@@ -192,57 +385,25 @@ Respond ONLY with valid JSON:
                 break
         
         # Check for \"all photos\" intent
-        show_all = any(phrase in query_lower for phrase in [
-            'all photos', 'all my photos', 'everything', 'show all'
-        ])
+        show_all = _SHOW_ALL_RE.search(query_lower) is not None
         
-        # Simple date parsing
+        # Simple date parsing: first month name in the query, optional year
         date_start, date_end = None, None
-        current_year = datetime.now().year
-        
-        # Month names
-        months = {
-            'january': 1, 'jan': 1,
-            'february': 2, 'feb': 2,
-            'march': 3, 'mar': 3,
-            'april': 4, 'apr': 4,
-            'may': 5,
-            'june': 6, 'jun': 6,
-            'july': 7, 'jul': 7,
-            'august': 8, 'aug': 8,
-            'september': 9, 'sep': 9, 'sept': 9,
-            'october': 10, 'oct': 10,
-            'november': 11, 'nov': 11,
-            'december': 12, 'dec': 12
-        }
-        
-        # Check for month names
-        for month_name, month_num in months.items():
-            if month_name in query_lower:
-                # Extract year if present
-                import re
-                year_match = re.search(r'20\d{2}', user_query)
-                year = int(year_match.group()) if year_match else current_year
-                
-                # Set date range for the entire month
-                date_start = f"{year}-{month_num:02d}-01"
-                # Last day of month
-                if month_num == 12:
-                    date_end = f"{year}-12-31"
-                else:
-                    from calendar import monthrange
-                    last_day = monthrange(year, month_num)[1]
-                    date_end = f"{year}-{month_num:02d}-{last_day}"
-                
-                logger.info(f"[SIMPLE PARSER] Detected month: {month_name} -> {date_start} to {date_end}")
-                break
+        month_match = _MONTH_RE.search(query_lower)
+        if month_match:
+            month_name = month_match.group(1)
+            month_num = _MONTHS[month_name]
+            year_match = _YEAR_RE.search(user_query)
+            year = int(year_match.group()) if year_match else datetime.now().year
+            
+            # Set date range for the entire month
+            date_start = f"{year}-{month_num:02d}-01"
+            date_end = f"{year}-{month_num:02d}-{monthrange(year, month_num)[1]:02d}"
+            
+            logger.info(f"[SIMPLE PARSER] Detected month: {month_name} -> {date_start} to {date_end}")
         
-        # Extract simple keywords
-        keywords = []
-        keyword_patterns = ['beach', 'party', 'wedding', 'birthday', 'vacation', 'trip']
-        for kw in keyword_patterns:
-            if kw in query_lower:
-                keywords.append(kw)
+        # Extract simple keywords (deduplicated, in order of appearance)
+        keywords = list(dict.fromkeys(_KEYWORD_RE.findall(query_lower)))
         
         result = {
             'location': location,
@@ -259,7 +420,8 @@ Respond ONLY with valid JSON:
         self,
         user_query: str,
         search_results: List[Dict],
-        search_criteria: Dict
+        search_criteria: Dict,
+        on_token: Optional[Callable[[str], None]] = None
     ) -> str:
         """
         Generate natural language response using AI.
@@ -268,15 +430,20 @@ Respond ONLY with valid JSON:
             user_query: User's original query
             search_results: Search results
             search_criteria: Parsed search criteria
+            on_token: Optional callback receiving the response text as it streams
+                      (cached/fallback responses are delivered as a single chunk)
             
         Returns:
             AI-generated response text
         """
+        emit = on_token or (lambda token: None)
         client = self._get_groq_client()
         
         if not client:
             # Fallback to simple response
-            return self._simple_response(user_query, search_results, search_criteria)
+            message = self._simple_response(user_query, search_results, search_criteria)
+            emit(message)
+            return message
         
         # Build context
         result_count = len(search_results)
@@ -289,42 +456,57 @@ Respond ONLY with valid JSON:
             if result.get('timestamp'):
                 dates_found.add(result['timestamp'][:10])  # Just date
         
-        context = f"""User query: "{user_query}"
-Search criteria: {json.dumps(search_criteria, indent=2)}
-Results found: {result_count} photos
-Locations in results: {', '.join(locations_found) if locations_found else 'No location data'}
-Dates in results: {', '.join(sorted(dates_found)[:5]) if dates_found else 'No date data'}"""
-        
-        system_prompt = """You are a friendly photo search assistant. 
-Generate a SHORT, natural response (1 sentence max, 15 words or less).
-Be helpful and encouraging.
-NO suggestions about "show_all" or technical terms.
-Use 1 emoji max.
-
-Examples:
-- Found photos: "Found 5 photos from Paris! 📸"
-- No results: "No photos from that date. Try 'show all my photos'?"
-- Location + date: "Found 3 photos from Paris in January! 🎉"
-"""
+        cache_key = (user_query, result_count, frozenset(locations_found), frozenset(dates_found))
+        with _cache_lock:
+            cached = _response_cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"AI response cache hit: {cached}")
+            emit(cached)
+            return cached
+        
+        # Compact one-line context: indented JSON only adds billed whitespace tokens
+        loc = search_criteria.get('location') or 'any'
+        ds, de = search_criteria.get('date_range') or (None, None)
+        places = ','.join(sorted(locations_found)[:3]) or '?'
+        dates = ','.join(sorted(dates_found)[:3]) or '?'
+        context = f'Q:"{user_query}" loc={loc} from={ds} to={de} n={result_count} places={places} dates={dates}'
         
+        system_prompt = "Reply in one friendly sentence (max 15 words, max 1 emoji) summarizing these photo search results. No technical terms."
+        
+        parts = []
         try:
-            response = client.chat.completions.create(
-                model=self.ai_model,
+            stream = client.chat.completions.create(
+                model=self.ai_model_respond,
                 messages=[
                     {"role": "system", "content": system_prompt},
                     {"role": "user", "content": context}
                 ],
                 temperature=0.7,
-                max_tokens=200
+                max_tokens=200,
+                stream=True
             )
             
-            ai_response = response.choices[0].message.content.strip()
+            for chunk in stream:
+                token = chunk.choices[0].delta.content
+                if token:
+                    parts.append(token)
+                    emit(token)
+            
+            ai_response = ''.join(parts).strip()
+            if not ai_response:
+                raise ValueError("empty completion")
+            
             logger.info(f"AI generated response: {ai_response}")
+            with _cache_lock:
+                _response_cache[cache_key] = ai_response
             return ai_response
             
         except Exception as e:
             logger.error(f"AI response generation failed: {e}")
-            return self._simple_response(user_query, search_results, search_criteria)
+            message = self._simple_response(user_query, search_results, search_criteria)
+            if not parts:
+                emit(message)
+            return message
     
     def _simple_response(
         self,
@@ -344,10 +526,101 @@ Examples:
         
         return f"Found {count} photo{'s' if count != 1 else ''}! 📸"
     
-    def search_photos(
+    async def _show_all(
+        self,
+        face_embedding: np.ndarray,
+        on_token: Optional[Callable[[str], None]]
+    ) -> Tuple[Dict, List[Dict], str]:
+        """Fast path for "show all my photos": face search only, no query parsing or AI reply."""
+        criteria = {
+            'location': None,
+            'date_range': (None, None),
+            'keywords': [],
+            'show_all': True,
+            'confidence': 1.0
+        }
+        face_matches = await asyncio.to_thread(
+            self.vector_db.search_similar_faces,
+            query_embedding=face_embedding,
+            top_k=self._search_top_k(criteria),
+            similarity_threshold=0.50
+        )
+        logger.info(f"[AI SEARCH] Show-all fast path: {len(face_matches)} photos")
+        
+        if face_matches:
+            ai_message = "Showing all your photos! 📸"
+        else:
+            ai_message = self._simple_response('', face_matches, criteria)
+        if on_token:
+            on_token(ai_message)
+        return criteria, face_matches, ai_message
+    
+    @staticmethod
+    def _search_top_k(criteria: Dict) -> int:
+        """
+        Number of matches to return: more when everything is wanted or results are filtered.
+        The criteria search fetches the show-all pool and cuts it to this after filtering.
+        """
+        if criteria['show_all']:
+            return _SHOW_ALL_TOP_K
+        if criteria['location'] or criteria['date_range'][0] or criteria['date_range'][1]:
+            return 200
+        return 100
+    
+    async def _search_with_criteria(
+        self,
+        face_embedding: np.ndarray,
+        user_query: str,
+        on_token: Optional[Callable[[str], None]]
+    ) -> Tuple[Dict, List[Dict], str]:
+        """Parse the query, search by face, apply location/date filters and phrase the reply."""
+        # Get available locations
+        all_locations = self.location_db.get_all_locations()
+        available_location_names = [loc['location_name'] for loc in all_locations]
+        
+        logger.info(f"[AI SEARCH] Available locations: {available_location_names}")
+        
+        # Parse query with AI (network) and search by face (local) concurrently.
+        # The search can't wait for the criteria, so it fetches the largest
+        # candidate set (show-all) unfiltered; filters and the criteria-specific
+        # limit are applied once both are done
+        criteria, face_matches = await asyncio.gather(
+            asyncio.to_thread(self.parse_query_with_ai, user_query, available_location_names),
+            asyncio.to_thread(
+                self.vector_db.search_similar_faces,
+                query_embedding=face_embedding,
+                top_k=_SHOW_ALL_TOP_K,
+                similarity_threshold=0.50
+            )
+        )
+        logger.info(f"[AI SEARCH] Parsed criteria: {criteria}")
+        logger.info(f"[AI SEARCH] Face matches: {len(face_matches)} photos")
+        
+        # Filter by location if specified (also attaches the location details);
+        # a "show all" request ignores any location/date the parser picked up
+        if criteria['location'] and not criteria['show_all']:
+            logger.info(f"[AI SEARCH] Filtering by location: {criteria['location']}")
+            face_matches = self._filter_by_location(face_matches, criteria['location'])
+            logger.info(f"[AI SEARCH] After location filter: {len(face_matches)} photos")
+        
+        # Filter by date if specified
+        if (criteria['date_range'][0] or criteria['date_range'][1]) and not criteria['show_all']:
+            logger.info(f"[AI SEARCH] Filtering by date range: {criteria['date_range']}")
+            face_matches = self._filter_by_date(face_matches, criteria['date_range'])
+            logger.info(f"[AI SEARCH] After date filter: {len(face_matches)} photos")
+        
+        face_matches = face_matches[:self._search_top_k(criteria)]
+        
+        # Generate AI response
+        ai_message = await asyncio.to_thread(self.generate_ai_response, user_query, face_matches, criteria, on_token)
+        
+        return criteria, face_matches, ai_message
+    
+    async def search_photos(
         self,
         session_id: str,
-        user_query: str
+        user_query: str,
+        on_token: Optional[Callable[[str], None]] = None
     ) -> Dict:
         """
         Main search function combining AI understanding + photo search.
@@ -355,6 +628,7 @@ Examples:
         Args:
             session_id: User's session ID
             user_query: Natural language query
+            on_token: Optional callback for streaming the AI message (see generate_ai_response)
             
         Returns:
             {
@@ -376,42 +650,17 @@ Examples:
         
         face_embedding = session['face_embedding']
         
-        # Get available locations
-        all_locations = self.location_db.get_all_locations()
-        available_location_names = [loc['location_name'] for loc in all_locations]
-        
         logger.info(f"[AI SEARCH] User query: '{user_query}'")
-        logger.info(f"[AI SEARCH] Available locations: {available_location_names}")
         
-        # Parse query with AI
-        criteria = self.parse_query_with_ai(user_query, available_location_names)
-        logger.info(f"[AI SEARCH] Parsed criteria: {criteria}")
-        
-        # Search by face first
-        face_matches = self.vector_db.search_similar_faces(
-            query_embedding=face_embedding,
-            top_k=100,
-            similarity_threshold=0.50
-        )
-        logger.info(f"[AI SEARCH] Face matches: {len(face_matches)} photos")
-        
-        # Filter by location if specified
-        if criteria['location']:
-            logger.info(f"[AI SEARCH] Filtering by location: {criteria['location']}")
-            face_matches = self._filter_by_location(face_matches, criteria['location'])
-            logger.info(f"[AI SEARCH] After location filter: {len(face_matches)} photos")
-        
-        # Filter by date if specified
-        if criteria['date_range'][0] or criteria['date_range'][1]:
-            logger.info(f"[AI SEARCH] Filtering by date range: {criteria['date_range']}")
-            face_matches = self._filter_by_date(face_matches, criteria['date_range'])
-            logger.info(f"[AI SEARCH] After date filter: {len(face_matches)} photos")
-        
-        # Generate AI response
-        ai_message = self.generate_ai_response(user_query, face_matches, criteria)
+        if user_query.lower().strip(' .!?') in _SHOW_ALL_PHRASES:
+            criteria, face_matches, ai_message = await self._show_all(face_embedding, on_token)
+        else:
+            criteria, face_matches, ai_message = await self._search_with_criteria(
+                face_embedding, user_query, on_token
+            )
         
         # Add to chat history
-        session['chat_history'].append({
+        self._append_chat_history(session_id, session, {
             'user': user_query,
             'ai': ai_message,
             'timestamp': datetime.now().isoformat()
@@ -425,26 +674,69 @@ Examples:
             'criteria': criteria
         }
     
+    async def search_photos_stream(self, session_id: str, user_query: str) -> AsyncIterator[Dict]:
+        """
+        Streaming variant of search_photos.
+        
+        Yields {'type': 'token', 'content': str} events while the AI message is
+        generated, then one {'type': 'result', ...} event holding the full
+        search_photos result (its 'ai_message' is the authoritative text).
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        done = object()
+        
+        def on_token(token: str):
+            # Called from the worker thread running generate_ai_response
+            loop.call_soon_threadsafe(queue.put_nowait, token)
+        
+        task = asyncio.create_task(self.search_photos(session_id, user_query, on_token=on_token))
+        task.add_done_callback(lambda _: queue.put_nowait(done))
+        
+        while True:
+            token = await queue.get()
+            if token is done:
+                break
+            yield {'type': 'token', 'content': token}
+        
+        yield {'type': 'result', **task.result()}
+    
+    def _location_key(self, photo_path: str) -> str:
+        """Resolve a match's photo path to its location_db key (uploads are keyed by filename)."""
+        if photo_path in self.location_db.locations:
+            return photo_path
+        return Path(photo_path).name
+    
+    @staticmethod
+    def _parse_query_date(value: Optional[str]) -> Optional[date]:
+        """Parse an ISO date from the parsed criteria (dateutil only as fallback)."""
+        if not value:
+            return None
+        try:
+            return date.fromisoformat(value[:10])
+        except ValueError:
+            from dateutil import parser as date_parser
+            return date_parser.parse(value).date()
+    
     def _filter_by_location(self, matches: List[Dict], location_query: str) -> List[Dict]:
         """Filter matches by location."""
-        filtered = []
-        query_lower = location_query.lower()
+        candidates = self.location_db.photos_matching_location(location_query)
+        if not candidates:
+            return []
         
+        filtered = []
         for match in matches:
             photo_path = match.get('photo_path')
             if not photo_path:
                 continue
             
-            # Get location from location_db
-            location_data = self.location_db.locations.get(photo_path)
-            if location_data:
-                location_name = location_data.get('location_name')
-                # Skip if location_name is None or empty
-                if location_name and query_lower in location_name.lower():
-                    match['location_name'] = location_name
-                    match['latitude'] = location_data.get('latitude')
-                    match['longitude'] = location_data.get('longitude')
-                    filtered.append(match)
+            key = self._location_key(photo_path)
+            if key in candidates:
+                location_data = self.location_db.locations[key]
+                match['location_name'] = location_data.get('location_name')
+                match['latitude'] = location_data.get('latitude')
+                match['longitude'] = location_data.get('longitude')
+                filtered.append(match)
         
         return filtered
     
@@ -455,58 +747,66 @@ Examples:
         
         logger.info(f"Filtering {len(matches)} photos by date range: {start_date} to {end_date}")
         
+        # Parse the bounds once, then resolve indexed photos with one range lookup
+        try:
+            start = self._parse_query_date(start_date)
+            end = self._parse_query_date(end_date)
+        except (ValueError, OverflowError) as e:
+            logger.warning(f"Invalid date range {date_range}: {e}")
+            return matches
+        in_range = self.location_db.photos_in_date_range(start, end)
+        # Checked once so per-match debug messages aren't formatted when unused
+        debug = logger.isEnabledFor(logging.DEBUG)
+        
         for match in matches:
             photo_path = match.get('photo_path')
             if not photo_path:
                 continue
             
             # Get timestamp from location_db
-            location_data = self.location_db.locations.get(photo_path)
-            timestamp = None
+            key = self._location_key(photo_path)
+            location_data = self.location_db.locations.get(key)
             
             if location_data and location_data.get('timestamp'):
-                timestamp = location_data['timestamp']
-            else:
-                # Fallback: Try to extract timestamp directly from EXIF
-                try:
-                    from utils.exif_extractor import EXIFExtractor
-                    metadata = EXIFExtractor.extract_metadata(photo_path)
-                    timestamp = metadata.get('timestamp')
-                except Exception as e:
+                if key in in_range:
+                    match['timestamp'] = location_data['timestamp']
+                    filtered.append(match)
+                continue
+            
+            # Fallback: Try to extract timestamp directly from EXIF
+            # (photos without GPS are not in location_db; cached per file)
+            timestamp = None
+            try:
+                timestamp = _exif_timestamp(photo_path, os.path.getmtime(photo_path))
+            except Exception as e:
+                if debug:
                     logger.debug(f"Could not extract timestamp from {photo_path}: {e}")
             
             if timestamp:
-                try:
-                    # Parse timestamp (format: "2026:01:15 16:55:58")
-                    photo_date = date_parser.parse(timestamp.replace(':', '-', 2)).date()
-                    
-                    # Check date range
-                    if start_date:
-                        start = date_parser.parse(start_date).date()
-                        if photo_date < start:
-                            logger.debug(f"Photo {photo_path} date {photo_date} before {start}")
-                            continue
-                    
-                    if end_date:
-                        end = date_parser.parse(end_date).date()
-                        if photo_date > end:
-                            logger.debug(f"Photo {photo_path} date {photo_date} after {end}")
-                            continue
-                    
-                    match['timestamp'] = timestamp
-                    filtered.append(match)
-                    logger.debug(f"Photo {photo_path} matches date range: {photo_date}")
-                    
-                except Exception as e:
-                    logger.warning(f"Failed to parse date for {photo_path}: {e}")
+                taken_at = parse_exif_timestamp(timestamp)
+                if taken_at is None:
+                    logger.warning(f"Failed to parse date for {photo_path}: {timestamp}")
+                    continue
+                
+                photo_date = taken_at.date()
+                if start and photo_date < start:
+                    if debug:
+                        logger.debug(f"Photo {photo_path} date {photo_date} before {start}")
+                    continue
+                if end and photo_date > end:
+                    if debug:
+                        logger.debug(f"Photo {photo_path} date {photo_date} after {end}")
                     continue
-            else:
+                
+                match['timestamp'] = timestamp
+                filtered.append(match)
+                if debug:
+                    logger.debug(f"Photo {photo_path} matches date range: {photo_date}")
+            elif debug:
                 logger.debug(f"No timestamp found for {photo_path}")
         
         logger.info(f"Date filter: {len(filtered)} photos match out of {len(matches)}")
         return filtered
-        
-        return filtered
 
 
 
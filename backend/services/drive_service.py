@@ -3,24 +3,100 @@
 Drive Service.
 Handles downloading folders from Google Drive and triggering processing.
 """
+import os
+import re
 import uuid
 import shutil
-import gdown
+import json
+import asyncio
+import logging
 from pathlib import Path
-from typing import Dict
+from typing import Dict, Optional
 import config
 from services.admin_service import get_admin_service
+from models.processed_files import file_digest, get_processed_file_index
+from utils.redis_client import get_redis
 
-# Global processing status
-# {task_id: {"status": "downloading"|"processing"|"completed"|"failed", "progress": "0/0", "details": ...}}
-tasks = {}
+logger = logging.getLogger(__name__)
+
+# Progress is logged once per this many files instead of per file
+_LOG_EVERY = 50
+
+# Images per bulk_mode() block: the FAISS index is written once per chunk, so
+# other writes to the room are never held back for longer than one chunk
+_BULK_CHUNK = 50
+
+# Drive URL shapes: /file/d/<id>/..., open?id=<id>, uc?id=<id>&export=...
+_DRIVE_FILE_RE = re.compile(r'(?:/file/d/|[?&]id=)([a-zA-Z0-9_-]+)')
+_DRIVE_FOLDER_RE = re.compile(r'/folders/([a-zA-Z0-9_-]+)')
+
+# Strong refs to fire-and-forget cleanup tasks (the loop only keeps weak ones)
+_cleanup_tasks = set()
+
+
+def _remove_dir_in_background(path: Path):
+    """Delete a temp directory without making the caller wait for it."""
+    task = asyncio.create_task(asyncio.to_thread(shutil.rmtree, path, ignore_errors=True))
+    _cleanup_tasks.add(task)
+    task.add_done_callback(_cleanup_tasks.discard)
 
-class DriveService:
 
+class TaskStore:
+    """
+    Drive import task status.
+    
+    Stored as a Redis hash per task (shared by all workers, expires after
+    _TASK_TTL_SECONDS) when REDIS_URL is configured, otherwise in process memory.
+    Shape: {"status": "downloading"|"processing"|"completed"|"failed", "progress": "0/0", ...}
+    """
+    
+    _TASK_TTL_SECONDS = 6 * 3600
+    _KEY = "pixelmatch:task:{}"
+    
     def __init__(self):
-        self.download_dir = config.BASE_DIR / "temp_drive_downloads"
-        self.download_dir.mkdir(exist_ok=True)
-        # We don't bind admin_service here anymore, we get it per task
+        self._tasks = {}
+    
+    def set(self, task_id: str, fields: Dict):
+        """Replace a task's status with fields."""
+        redis_client = get_redis()
+        if redis_client is None:
+            self._tasks[task_id] = dict(fields)
+            return
+        key = self._KEY.format(task_id)
+        pipe = redis_client.pipeline()
+        pipe.delete(key)
+        pipe.hset(key, mapping={k: json.dumps(v) for k, v in fields.items()})
+        pipe.expire(key, self._TASK_TTL_SECONDS)
+        pipe.execute()
+    
+    def update(self, task_id: str, **fields):
+        """Merge fields into a task's status."""
+        redis_client = get_redis()
+        if redis_client is None:
+            self._tasks.setdefault(task_id, {}).update(fields)
+            return
+        key = self._KEY.format(task_id)
+        pipe = redis_client.pipeline()
+        pipe.hset(key, mapping={k: json.dumps(v) for k, v in fields.items()})
+        pipe.expire(key, self._TASK_TTL_SECONDS)
+        pipe.execute()
+    
+    def get(self, task_id: str) -> Optional[Dict]:
+        """Get a task's status, or None if unknown (or expired)."""
+        redis_client = get_redis()
+        if redis_client is None:
+            task = self._tasks.get(task_id)
+            return dict(task) if task is not None else None
+        data = redis_client.hgetall(self._KEY.format(task_id))
+        if not data:
+            return None
+        return {k.decode(): json.loads(v) for k, v in data.items()}
+
+
+# Global processing status
+task_store = TaskStore()
+
+class DriveService:
 
     async def process_drive_link(self, url: str, task_id: str, room_id: str = None):
         """
@@ -29,6 +105,7 @@ class DriveService:
         """
         # Resolve dependencies based on room_id
         admin_service = get_admin_service(room_id)
+        processed_files = get_processed_file_index(room_id)
         if room_id:
              from services.room_service import get_room_service
              room_path = get_room_service().get_room_path(room_id)
@@ -36,23 +113,31 @@ class DriveService:
         else:
              target_upload_dir = config.UPLOAD_DIR
              
-        tasks[task_id] = {"status": "downloading", "progress": "0%", "message": "Downloading from Drive..."}
+        task_store.set(task_id, {"status": "downloading", "progress": "0%", "message": "Downloading from Drive..."})
         
-        task_dir = self.download_dir / task_id
-        task_dir.mkdir(exist_ok=True)
+        # Hidden temp dir inside the uploads dir: same filesystem, so moving a
+        # downloaded image into place is a rename rather than a copy
+        task_dir = target_upload_dir / f".tmp_{task_id}"
+        task_dir.mkdir(parents=True, exist_ok=True)
         
         try:
+            # Imported here: gdown (and its requests/bs4 stack) is only needed
+            # when an import actually runs, not to start the app
+            import gdown
+            
             # Determine if URL is a file or folder
-            is_folder = 'folders' in url or '/drive/folders/' in url
+            is_folder = _DRIVE_FOLDER_RE.search(url) is not None
             
             if is_folder:
                 # 1a. Download Folder
-                print(f"[DRIVE] Downloading Drive folder: {url}")
+                logger.info(f"[DRIVE] Downloading Drive folder: {url}")
                 # gdown.download_folder returns list of files
                 # Use fuzzy=True to handle permission issues better
                 # Use remaining_ok=True to continue even if some files fail
+                # gdown blocks for the whole download, so keep it off the event loop
                 try:
-                    files = gdown.download_folder(
+                    files = await asyncio.to_thread(
+                        gdown.download_folder,
                         url, 
                         output=str(task_dir), 
                         quiet=False,  # Show progress for debugging
@@ -60,55 +145,49 @@ class DriveService:
                         remaining_ok=True  # Continue even if some files fail
                     )
                 except Exception as e:
-                    print(f"[DRIVE] ERROR during folder download: {str(e)}")
+                    logger.error(f"[DRIVE] ERROR during folder download: {str(e)}")
                     # Try to salvage any files that were downloaded
                     files = []
                     if task_dir.exists():
                         files = [str(f) for f in task_dir.rglob('*') if f.is_file()]
                     
                     if not files:
-                        tasks[task_id] = {
+                        task_store.set(task_id, {
                             "status": "failed", 
                             "error": f"Failed to download folder. Error: {str(e)}. Make sure folder is shared as 'Anyone with the link'."
-                        }
+                        })
                         return
                 
                 if not files:
-                    print(f"[DRIVE] ERROR: No files found or download failed")
-                    tasks[task_id] = {"status": "failed", "error": "No files found or download failed. Make sure the folder is shared as 'Anyone with the link'."}
+                    logger.error("[DRIVE] ERROR: No files found or download failed")
+                    task_store.set(task_id, {"status": "failed", "error": "No files found or download failed. Make sure the folder is shared as 'Anyone with the link'."})
                     return
                 
-                print(f"[DRIVE] Downloaded {len(files)} files successfully")
+                logger.info(f"[DRIVE] Downloaded {len(files)} files successfully")
             else:
                 # 1b. Download Single File
-                print(f"[DRIVE] Downloading single file from Drive: {url}")
+                logger.info(f"[DRIVE] Downloading single file from Drive: {url}")
                 
                 # Extract file ID from various URL formats
-                file_id = None
-                if '/file/d/' in url:
-                    file_id = url.split('/file/d/')[1].split('/')[0]
-                elif 'id=' in url:
-                    file_id = url.split('id=')[1].split('&')[0]
-                elif '/uc?id=' in url:
-                    file_id = url.split('id=')[1].split('&')[0]
+                match = _DRIVE_FILE_RE.search(url)
+                file_id = match.group(1) if match else None
                 
                 if not file_id:
-                    tasks[task_id] = {"status": "failed", "error": "Invalid Google Drive URL. Please use a valid file or folder link."}
+                    task_store.set(task_id, {"status": "failed", "error": "Invalid Google Drive URL. Please use a valid file or folder link."})
                     return
                 
                 # Download the file
                 output_path = task_dir / "downloaded_file"
                 try:
-                    gdown.download(id=file_id, output=str(output_path), quiet=False)
+                    await asyncio.to_thread(gdown.download, id=file_id, output=str(output_path), quiet=False)
                     files = [str(output_path)]
-                    print(f"[DRIVE] Downloaded file successfully")
+                    logger.info("[DRIVE] Downloaded file successfully")
                 except Exception as e:
-                    print(f"[DRIVE] ERROR: Failed to download file: {str(e)}")
-                    tasks[task_id] = {"status": "failed", "error": f"Failed to download file. Make sure the file is shared as 'Anyone with the link'. Error: {str(e)}"}
+                    logger.error(f"[DRIVE] ERROR: Failed to download file: {str(e)}")
+                    task_store.set(task_id, {"status": "failed", "error": f"Failed to download file. Make sure the file is shared as 'Anyone with the link'. Error: {str(e)}"})
                     return
             
-            tasks[task_id]["status"] = "processing"
-            tasks[task_id]["message"] = f"Downloaded {len(files)} file(s). Processing AI..."
+            task_store.update(task_id, status="processing", message=f"Downloaded {len(files)} file(s). Processing AI...")
             
             # 2. Move files to main Uploads dir
             # Let's move valid images to target_upload_dir to keep them permanent
@@ -123,76 +202,119 @@ class DriveService:
                         target = target_upload_dir / f"{uuid.uuid4().hex[:6]}_{path.name}"
                     
                     try:
-                        shutil.move(str(path), str(target))
+                        # Same filesystem as the temp dir: a single atomic rename
+                        try:
+                            os.replace(path, target)
+                        except OSError:
+                            # e.g. EXDEV when uploads live on a separate mount
+                            shutil.move(str(path), str(target))
                         valid_images.append(target)
-                        print(f"[DRIVE] Moved {path.name} -> {target.name}")
+                        if len(valid_images) % _LOG_EVERY == 0:
+                            logger.info(f"[DRIVE] Moved {len(valid_images)} files...")
                     except Exception as move_err:
-                        print(f"[DRIVE] ERROR moving file {path.name}: {move_err}")
-
-            
-            # Cleanup temp
-            if task_dir.exists():
-                shutil.rmtree(task_dir)
+                        logger.error(f"[DRIVE] ERROR moving file {path.name}: {move_err}")
+            logger.info(f"[DRIVE] Moved {len(valid_images)} image(s) to {target_upload_dir}")
             
             if not valid_images:
-                print(f"[DRIVE] ERROR: No valid images found")
-                tasks[task_id] = {"status": "failed", "error": "No valid images found. Supported formats: JPG, PNG, BMP, WEBP"}
+                logger.error("[DRIVE] ERROR: No valid images found")
+                task_store.set(task_id, {"status": "failed", "error": "No valid images found. Supported formats: JPG, PNG, BMP, WEBP"})
                 return
             
-            print(f"[DRIVE] Starting face recognition processing for {len(valid_images)} images")
+            logger.info(f"[DRIVE] Starting face recognition processing for {len(valid_images)} images")
             
             # 3. Process Photos
-            tasks[task_id]["total"] = len(valid_images)
-            tasks[task_id]["processed"] = 0
-            
-            # We call process_local_files. But process_local_files is all-at-once.
-            # To show progress, we might want to chunk it or update status inside?
-            # For simplicity, let's call the batch function, and update status at end.
-            # Or better: Iterate here and reuse logic?
-            # But process_local_files calls _process_image_file.
+            task_store.update(task_id, total=len(valid_images), processed=0, progress=f"0/{len(valid_images)}")
             
             processed_count = 0
             stats = {
                 'successful': 0, 
                 'failed': 0, 
-                'total_faces': 0
+                'total_faces': 0,
+                'duplicates_skipped': 0
             }
             
-            for img_path in valid_images:
-                tasks[task_id]["message"] = f"Processing {img_path.name}..."
-                tasks[task_id]["progress"] = f"{processed_count}/{len(valid_images)}"
-                
-                print(f"[DRIVE] Processing image {processed_count + 1}/{len(valid_images)}: {img_path.name}")
-                
-                try:
-                    result = await admin_service._process_image_file(img_path)
-                    
-                    if result['success']:
-                        stats['successful'] += 1
-                        stats['total_faces'] += result['faces_detected']
-                        print(f"[DRIVE] ✓ {img_path.name}: {result['faces_detected']} faces detected, {result.get('faces_stored', 0)} stored")
-                    else:
+            # Overlap image loading / EXIF parsing across images; model inference
+            # itself is serialized inside AdminService
+            sem = asyncio.Semaphore(max(1, config.DRIVE_CONCURRENCY))
+            # A recorded hash only counts if its photo still has faces indexed
+            indexed_photos = admin_service.vector_db.get_photo_paths()
+            # First path seen for each hash in this import (identical files in one folder)
+            batch_digests = {}
+            
+            async def _process_one(img_path: Path):
+                nonlocal processed_count
+                async with sem:
+                    task_store.update(task_id, message=f"Processing {img_path.name}...")
+                    try:
+                        # Identical bytes already indexed (e.g. a re-shared folder): drop the copy
+                        digest = await asyncio.to_thread(file_digest, img_path)
+                        existing = processed_files.find(digest)
+                        if existing not in indexed_photos:
+                            existing = None
+                        # No await between the lookup and the claim, so concurrent
+                        # copies of the same file can't both miss it
+                        existing = existing or batch_digests.setdefault(digest, str(img_path))
+                        if existing != str(img_path):
+                            img_path.unlink(missing_ok=True)
+                            stats['successful'] += 1
+                            stats['duplicates_skipped'] += 1
+                        else:
+                            result = await admin_service._process_image_file(img_path)
+                            
+                            if result['success']:
+                                processed_files.add(digest, str(img_path))
+                                stats['successful'] += 1
+                                stats['total_faces'] += result['faces_detected']
+                            else:
+                                stats['failed'] += 1
+                                logger.warning(f"[DRIVE] ✗ {img_path.name}: {result.get('error', 'Unknown error')}")
+                    except Exception as e:
                         stats['failed'] += 1
-                        print(f"[DRIVE] ✗ {img_path.name}: {result.get('error', 'Unknown error')}")
-                except Exception as e:
-                    stats['failed'] += 1
-                    print(f"[DRIVE] ✗ {img_path.name}: Exception - {str(e)}")
-                
-                processed_count += 1
-                tasks[task_id]["processed"] = processed_count
+                        logger.warning(f"[DRIVE] ✗ {img_path.name}: Exception - {str(e)}")
+                    
+                    processed_count += 1
+                    task_store.update(
+                        task_id,
+                        processed=processed_count,
+                        progress=f"{processed_count}/{len(valid_images)}"
+                    )
+                    if processed_count % _LOG_EVERY == 0 or processed_count == len(valid_images):
+                        logger.info(
+                            f"[DRIVE] Processed {processed_count}/{len(valid_images)} images "
+                            f"({stats['total_faces']} faces so far)"
+                        )
             
-            tasks[task_id] = {
+            # Write the FAISS index once per chunk rather than per image. Bulk mode
+            # defers every write to this room's index (uploads and deletes too),
+            # so it isn't held across the whole import
+            for start in range(0, len(valid_images), _BULK_CHUNK):
+                with admin_service.vector_db.bulk_mode():
+                    await asyncio.gather(
+                        *(_process_one(p) for p in valid_images[start:start + _BULK_CHUNK])
+                    )
+            
+            # Name the imported GPS points with one batched reverse-geocode lookup
+            task_store.update(task_id, message="Resolving photo locations...")
+            located = await asyncio.to_thread(
+                admin_service.location_db.fill_missing_location_names,
+                [p.name for p in valid_images]
+            )
+            if located:
+                logger.info(f"[DRIVE] Resolved location names for {located} photo(s)")
+            
+            task_store.set(task_id, {
                 "status": "completed",
                 "progress": "100%",
                 "stats": stats
-            }
+            })
             
         except Exception as e:
-            print(f"Drive processing failed: {e}")
-            tasks[task_id] = {"status": "failed", "error": str(e)}
-            # Cleanup
+            logger.error(f"[DRIVE] Drive processing failed: {e}")
+            task_store.set(task_id, {"status": "failed", "error": str(e)})
+        finally:
+            # Every exit (early failure returns included) drops the partial downloads
             if task_dir.exists():
-                shutil.rmtree(task_dir)
+                _remove_dir_in_background(task_dir)
 
 _drive_service = None
 def get_drive_service():
@@ -4,20 +4,27 @@ Handles selfie uploads and photo matching.
 """
 
 from pathlib import Path
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 import uuid
+import logging
+
+import numpy as np
 
 from models.face_detection import FaceDetector
 from models.face_recognition import get_facenet_model
 from models.vector_db import get_vector_db
+from models.selfie_cache import SelfieEmbeddingCache, get_selfie_cache
 from utils.image_processing import (
     load_image_from_bytes,
+    pooled_image_from_bytes,
     crop_face,
     preprocess_face,
     save_image
 )
 import config
 
+logger = logging.getLogger(__name__)
+
 
 class GuestService:
     """Service for guest operations (selfie upload and photo search)."""
@@ -28,6 +35,7 @@ class GuestService:
         self.face_detector = FaceDetector()
         self.face_recognizer = get_facenet_model()
         self.vector_db = get_vector_db(room_id)
+        self.embedding_cache = get_selfie_cache()
         
         # Room-specific selfie handling could be added here
         if room_id:
@@ -79,54 +87,13 @@ class GuestService:
                 'error': f'Failed to save selfie: {e}'
             }
         
-        # Load image
-        image = load_image_from_bytes(selfie_bytes)
-        
-        if image is None:
-            return {
-                'success': False,
-                'error': 'Failed to load selfie image'
-            }
-        
-        # Detect face in selfie
-        print(f"[GUEST] Detecting face in selfie: {filename}")
-        face_result = self.face_detector.detect_single_face(image)
-        
-        if face_result is None:
-            print(f"[GUEST] ERROR: No face detected in selfie")
-            return {
-                'success': False,
-                'error': 'No face detected in selfie. Please upload a clear photo of your face.'
-            }
-        
-        bbox, confidence = face_result
-        print(f"[GUEST] Face detected with confidence: {confidence:.2f}")
-        
-        # Crop and preprocess face
-        face_img = crop_face(image, bbox)
-        
-        if face_img is None:
-            return {
-                'success': False,
-                'error': 'Failed to extract face from selfie'
-            }
-        
-        preprocessed = preprocess_face(face_img, config.FACE_SIZE)
-        
-        # Generate embedding with TTA enabled for maximum accuracy
-        # TTA (Test Time Augmentation) improves matching by ~15-20%
-        print(f"[GUEST] Generating embedding for selfie (TTA enabled for accuracy)")
-        embedding = self.face_recognizer.generate_embedding(preprocessed, enable_tta=True)
-        
+        embedding, error = self.get_selfie_embedding(selfie_bytes, filename)
         if embedding is None:
-            print(f"[GUEST] ERROR: Failed to generate embedding")
             return {
                 'success': False,
-                'error': 'Failed to generate face embedding'
+                'error': error
             }
         
-        print(f"[GUEST] Embedding generated successfully (dim: {len(embedding)})")
-        
         # Multi-Stage Search for better recall
         # Stage 1: High confidence matches (strict threshold)
         # Stage 2: If few results, lower threshold to find difficult photos
@@ -134,70 +101,52 @@ class GuestService:
         max_results = top_k or config.MAX_RESULTS
         primary_threshold = similarity_threshold or config.SIMILARITY_THRESHOLD
         
-        print(f"[GUEST] Starting Multi-Stage Search")
-        print(f"[GUEST] Database contains {self.vector_db.get_count()} total embeddings")
+        logger.info("[GUEST] Starting Multi-Stage Search")
+        logger.info("[GUEST] Database contains %d total embeddings", self.vector_db.get_count())
         
-        # Stage 1: High confidence search
-        print(f"[GUEST] Stage 1: Searching with threshold {primary_threshold:.2f} (high confidence)")
-        matches_stage1 = self.vector_db.search_similar_faces(
+        # Smart Expand / Deep Fallback thresholds
+        # If we found at least one photo, we trust the person is present at the event
+        # and lower the threshold for "related" photos; if we found none, the user
+        # may only appear in solo/difficult shots and needs a much lower floor.
+        secondary_threshold = max(0.42, primary_threshold - 0.10)
+        fallback_threshold = 0.30
+        
+        # One index scan at the lowest threshold any stage can use; the stages
+        # are then partitioned from the (similarity-sorted) results
+        candidates = self.vector_db.search_similar_faces(
             query_embedding=embedding,
             top_k=max_results,
-            similarity_threshold=primary_threshold
+            similarity_threshold=min(primary_threshold, fallback_threshold)
         )
         
-        print(f"[GUEST] Stage 1: Found {len(matches_stage1)} high-confidence matches")
-        
-        # Stage 2: Smart Expand (Recursive Search)
-        
-        all_matches = matches_stage1.copy()
+        # Stage 1: High confidence matches
+        matches_stage1 = [m for m in candidates if m['similarity'] >= primary_threshold]
+        logger.info("[GUEST] Stage 1: Found %d matches at threshold %.2f (high confidence)", len(matches_stage1), primary_threshold)
         
         if matches_stage1:
-            print(f"[GUEST] Stage 2: Smart Expand - Using top matches to find related photos...")
-            
-            # Smart Expand Strategy:
-            # If we found at least one photo, we trust the person is present at the event.
-            # We can aggressively lower the threshold for "related" searches.
-            
-            secondary_threshold = max(0.42, primary_threshold - 0.10) 
-            
+            all_matches = matches_stage1
             if len(matches_stage1) < 8:
-                 print(f"[GUEST] Smart Expand: detailed broad search at {secondary_threshold:.2f}")
-                 matches_stage2 = self.vector_db.search_similar_faces(
-                    query_embedding=embedding,
-                    top_k=max_results,
-                    similarity_threshold=secondary_threshold
-                )
-                
-                 existing_ids = {m['id'] for m in all_matches}
-                 new_matches = [m for m in matches_stage2 if m['id'] not in existing_ids]
-                 
-                 for m in new_matches:
-                     m['is_expanded'] = True
-                     
-                 all_matches.extend(new_matches)
-                 print(f"[GUEST] Smart Expand: Found {len(new_matches)} additional photos")
-            
+                # Stage 2: Smart Expand
+                new_matches = [
+                    m for m in candidates
+                    if secondary_threshold <= m['similarity'] < primary_threshold
+                ]
+                for m in new_matches:
+                    m['is_expanded'] = True
+                all_matches.extend(new_matches)
+                logger.info("[GUEST] Smart Expand at %.2f: Found %d additional photos", secondary_threshold, len(new_matches))
         else:
-             # Fallback: excessive aggressive search if NO matches found initially
-             # User said "solo photos not identified" -> they need a lower floor
-             fallback_threshold = 0.30  # Deep dive to 30% as requested
-             print(f"[GUEST] Stage 2: Deep Fallback search at {fallback_threshold:.2f}")
-             
-             matches_fallback = self.vector_db.search_similar_faces(
-                query_embedding=embedding,
-                top_k=max_results,
-                similarity_threshold=fallback_threshold
-            )
-             all_matches.extend(matches_fallback)
-             print(f"[GUEST] Fallback: Found {len(matches_fallback)} photos")
+            # Stage 2: Deep Fallback
+            all_matches = candidates
+            logger.info("[GUEST] Fallback at %.2f: Found %d photos", fallback_threshold, len(all_matches))
         
         # Sort all matches by similarity
         all_matches.sort(key=lambda x: x['similarity'], reverse=True)
         
-        print(f"[GUEST] Total matches found: {len(all_matches)}")
+        logger.info("[GUEST] Total matches found: %d", len(all_matches))
         if all_matches:
-            print(f"[GUEST] Top match similarity: {all_matches[0]['similarity']:.4f}")
-            print(f"[GUEST] Lowest match similarity: {all_matches[-1]['similarity']:.4f}")
+            logger.info("[GUEST] Top match similarity: %.4f", all_matches[0]['similarity'])
+            logger.info("[GUEST] Lowest match similarity: %.4f", all_matches[-1]['similarity'])
         
         if not all_matches:
             return {
@@ -209,13 +158,17 @@ class GuestService:
         
         # Group matches by photo (for privacy mode and deduplication)
         if config.ENABLE_PRIVACY_MODE:
-            photo_matches = self._group_matches_by_photo(all_matches)
+            photo_matches = self._group_matches_by_photo(all_matches, max_results)
         else:
-            photo_matches = self._group_matches_by_photo(all_matches)
-        
-        print(f"[GUEST] Grouped into {len(photo_matches)} unique photos")
-        for i, photo in enumerate(photo_matches[:3]):  # Show top 3
-            print(f"[GUEST]   #{i+1}: {photo['photo_name']} (similarity: {photo['max_similarity']:.4f}, faces: {photo['face_count']})")
+            photo_matches = self._group_matches_by_photo(all_matches, max_results)
+        
+        logger.info("[GUEST] Grouped into %d unique photos", len(photo_matches))
+        if logger.isEnabledFor(logging.INFO):
+            for i, photo in enumerate(photo_matches[:3], 1):  # Show top 3
+                logger.info(
+                    "[GUEST]   #%d: %s (similarity: %.4f, faces: %d)",
+                    i, photo['photo_name'], photo['max_similarity'], photo['face_count']
+                )
         
         return {
             'success': True,
@@ -224,52 +177,157 @@ class GuestService:
             'selfie_path': str(selfie_path)
         }
     
-    def _group_matches_by_photo(self, matches: List[Dict]) -> List[Dict]:
+    def detect_selfie_face(self, selfie_bytes: bytes) -> Tuple[Optional[np.ndarray], Optional[Tuple]]:
         """
-        Group face matches by photo and aggregate information.
+        Decode a selfie and detect its most prominent face.
         
         Args:
-            matches: List of face matches from vector database
+            selfie_bytes: Selfie image bytes
             
         Returns:
-            List of photo-level matches with aggregated data
+            (image, (bbox, confidence)); image is None if decoding failed and
+            the face result is None if no face was found
+        """
+        image = load_image_from_bytes(selfie_bytes, config.SELFIE_DECODE_MIN_SIDE)
+        if image is None:
+            return None, None
+        return image, self.face_detector.detect_single_face(image)
+    
+    def get_selfie_embedding(
+        self,
+        selfie_bytes: bytes,
+        filename: str = "selfie.jpg",
+        image: np.ndarray = None,
+        face_result: Tuple = None
+    ) -> Tuple[Optional[np.ndarray], Optional[str]]:
         """
-        photo_dict = {}
+        Get the face embedding for a selfie.
         
-        for match in matches:
-            photo_path = match['photo_path']
+        Args:
+            selfie_bytes: Selfie image bytes (also the cache key)
+            filename: Original filename (for logging)
+            image: Already decoded selfie, if the caller has one
+            face_result: Already detected (bbox, confidence) in image, if the caller has one
             
-            if photo_path not in photo_dict:
-                photo_dict[photo_path] = {
-                    'photo_path': photo_path,
-                    'photo_name': Path(photo_path).name,
-                    'faces_found': [],
-                    'max_similarity': 0.0,
-                    'avg_similarity': 0.0
-                }
+        Returns:
+            (embedding, None) on success, (None, error message) on failure
+        """
+        # Re-submitted selfies reuse their cached embedding (no detection / TTA inference)
+        cache_key = SelfieEmbeddingCache.make_key(
+            selfie_bytes,
+            self.face_recognizer.model_version,
+            config.SELFIE_DECODE_MIN_SIDE,
+            config.ENABLE_TTA
+        )
+        embedding = self.embedding_cache.get(cache_key)
+        
+        if embedding is not None:
+            logger.info("[GUEST] Using cached selfie embedding (dim: %d)", len(embedding))
+            return embedding, None
+        
+        # Load image and detect face unless the caller already did (e.g. after validation)
+        if image is not None and face_result is not None:
+            preprocessed, error = self._preprocess_selfie_face(image, face_result)
+        else:
+            logger.info("[GUEST] Detecting face in selfie: %s", filename)
+            # The decoded selfie is only needed until its face crop is preprocessed
+            with pooled_image_from_bytes(selfie_bytes, config.SELFIE_DECODE_MIN_SIDE) as image:
+                if image is not None:
+                    face_result = self.face_detector.detect_single_face(image)
+                preprocessed, error = self._preprocess_selfie_face(image, face_result)
+        
+        if error:
+            return None, error
+        
+        # Generate embedding with TTA enabled for maximum accuracy
+        # TTA (Test Time Augmentation) improves matching by ~15-20%
+        logger.info("[GUEST] Generating embedding for selfie (TTA enabled for accuracy)")
+        embedding = self.face_recognizer.generate_embedding(preprocessed, enable_tta=True)
+        
+        if embedding is None:
+            logger.error("[GUEST] Failed to generate embedding")
+            return None, 'Failed to generate face embedding'
+        
+        logger.info("[GUEST] Embedding generated successfully (dim: %d)", len(embedding))
+        self.embedding_cache.put(cache_key, embedding)
+        return embedding, None
+    
+    def _preprocess_selfie_face(
+        self,
+        image: Optional[np.ndarray],
+        face_result: Optional[Tuple]
+    ) -> Tuple[Optional[np.ndarray], Optional[str]]:
+        """
+        Crop and preprocess the detected selfie face.
+        
+        Returns:
+            (preprocessed face, None) on success, (None, error message) on failure
+        """
+        if image is None:
+            return None, 'Failed to load selfie image'
+        
+        if face_result is None:
+            logger.warning("[GUEST] No face detected in selfie")
+            return None, 'No face detected in selfie. Please upload a clear photo of your face.'
+        
+        bbox, confidence = face_result
+        logger.info("[GUEST] Face detected with confidence: %.2f", confidence)
+        
+        # Crop and preprocess face
+        face_img = crop_face(image, bbox)
+        
+        if face_img is None:
+            return None, 'Failed to extract face from selfie'
+        
+        return preprocess_face(face_img, config.FACE_SIZE), None
+    
+    def _group_matches_by_photo(self, matches: List[Dict], max_results: Optional[int] = None) -> List[Dict]:
+        """
+        Group face matches by photo and aggregate information.
+        
+        Args:
+            matches: List of face matches from vector database
+            max_results: Keep only this many best photos (None keeps all)
             
-            # Add face info
-            photo_dict[photo_path]['faces_found'].append({
+        Returns:
+            List of photo-level matches with aggregated data
+        """
+        if not matches:
+            return []
+        
+        # Per-photo count / sum / max computed in NumPy instead of per-match dict updates
+        paths = [match['photo_path'] for match in matches]
+        sims = np.fromiter((match['similarity'] for match in matches), dtype=np.float64, count=len(matches))
+        uniq, inv = np.unique(np.array(paths), return_inverse=True)
+        
+        counts = np.bincount(inv, minlength=len(uniq))
+        sums = np.bincount(inv, weights=sims, minlength=len(uniq))
+        maxs = np.zeros(len(uniq), dtype=np.float64)
+        np.maximum.at(maxs, inv, sims)
+        # First appearance of each photo, to keep the original order among equal scores
+        first_seen = np.full(len(uniq), len(matches), dtype=np.int64)
+        np.minimum.at(first_seen, inv, np.arange(len(matches)))
+        
+        faces_found = [[] for _ in range(len(uniq))]
+        for match, group in zip(matches, inv.tolist()):
+            faces_found[group].append({
                 'bbox': match['bbox'],
                 'similarity': match['similarity']
             })
-            
-            # Update max similarity
-            if match['similarity'] > photo_dict[photo_path]['max_similarity']:
-                photo_dict[photo_path]['max_similarity'] = match['similarity']
-        
-        # Calculate average similarities and convert to list
-        photo_matches = []
-        for photo_data in photo_dict.values():
-            similarities = [face['similarity'] for face in photo_data['faces_found']]
-            photo_data['avg_similarity'] = sum(similarities) / len(similarities)
-            photo_data['face_count'] = len(photo_data['faces_found'])
-            photo_matches.append(photo_data)
-        
-        # Sort by max similarity (best matches first)
-        photo_matches.sort(key=lambda x: x['max_similarity'], reverse=True)
-        
-        return photo_matches
+        
+        # Sort by max similarity (best matches first); only the kept photos get dicts built
+        order = np.lexsort((first_seen, -maxs))[:max_results]
+        return [
+            {
+                'photo_path': str(uniq[g]),
+                'photo_name': Path(str(uniq[g])).name,
+                'faces_found': faces_found[g],
+                'max_similarity': float(maxs[g]),
+                'avg_similarity': float(sums[g] / counts[g]),
+                'face_count': int(counts[g])
+            }
+            for g in order.tolist()
+        ]
     
     def get_photo_file(self, photo_path: str) -> Optional[bytes]:
         """
@@ -291,7 +349,7 @@ class GuestService:
                 return f.read()
                 
         except Exception as e:
-            print(f"Error reading photo {photo_path}: {e}")
+            logger.error("[GUEST] Error reading photo %s: %s", photo_path, e)
             return None
     
     def validate_selfie(self, selfie_bytes: bytes) -> Dict:
@@ -304,8 +362,8 @@ class GuestService:
         Returns:
             Dict with validation result
         """
-        # Load image
-        image = load_image_from_bytes(selfie_bytes)
+        # Load image and check if face is detected
+        image, face_result = self.detect_selfie_face(selfie_bytes)
         
         if image is None:
             return {
@@ -313,9 +371,6 @@ class GuestService:
                 'error': 'Invalid image file'
             }
         
-        # Check if face is detected
-        face_result = self.face_detector.detect_single_face(image)
-        
         if face_result is None:
             return {
                 'valid': False,
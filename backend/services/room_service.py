@@ -5,31 +5,68 @@ Handles creating and validating event rooms.
 """
 
 import json
-import random
+import secrets
 import string
 import shutil
+import threading
 from pathlib import Path
-from typing import Dict, Optional, List
+from typing import Dict, Optional, List, Union
+from cachetools import TTLCache
 import config
 
+import hmac
 import hashlib
+import bcrypt
+
+try:
+    import orjson
+except ImportError:  # optional speedup; stdlib json is used otherwise
+    orjson = None
 
 ROOMS_DIR = Path("data/rooms")
 
+# Parsed metadata.json per room, so lookups on every request skip the disk
+_ROOM_CACHE_TTL = 60
+
+# CSPRNG-backed shuffling for room IDs (IDs grant access to a room's photos)
+_rng = secrets.SystemRandom()
+
+
+def _dump_json(obj: Dict) -> bytes:
+    """Serialize room metadata (2-space indented, like json.dump(indent=2))."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+    return json.dumps(obj, indent=2).encode("utf-8")
+
+
+def _load_json(data: bytes) -> Dict:
+    """Parse room metadata."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _to_bytes(password: Union[str, bytes]) -> bytes:
+    """UTF-8 encode a password unless the caller already passed bytes."""
+    return password if isinstance(password, bytes) else password.encode("utf-8")
+
+
 class RoomService:
     """Service for managing Event Rooms."""
     
     def __init__(self):
         ROOMS_DIR.mkdir(parents=True, exist_ok=True)
+        self._room_cache = TTLCache(maxsize=1024, ttl=_ROOM_CACHE_TTL)
+        self._room_cache_lock = threading.Lock()
     
     def _generate_room_id(self, length: int = 6) -> str:
         """Generate a random alphanumeric room ID (e.g., A7X92B)."""
         chars = string.ascii_uppercase + string.digits
-        # Ensure at least one letter and one number
-        while True:
-            code = ''.join(random.choices(chars, k=length))
-            if any(c.isdigit() for c in code) and any(c.isalpha() for c in code):
-                return code
+        # Guarantee at least one letter and one number without rejection sampling
+        code = [secrets.choice(chars) for _ in range(length - 2)]
+        code += [secrets.choice(string.ascii_uppercase), secrets.choice(string.digits)]
+        _rng.shuffle(code)
+        return ''.join(code)
 
     def create_room(self, event_name: str, password: str = None) -> Dict:
         """
@@ -38,22 +75,24 @@ class RoomService:
         Returns:
             Dict containing room_id and event_name
         """
-        # Generate unique ID
+        # Generate unique ID (mkdir is the atomic uniqueness check)
         while True:
             room_id = self._generate_room_id()
             room_path = ROOMS_DIR / room_id
-            if not room_path.exists():
+            try:
+                room_path.mkdir(exist_ok=False)
                 break
+            except FileExistsError:
+                continue
         
         # Create directory structure
-        room_path.mkdir()
         (room_path / "uploads").mkdir()
         (room_path / "chromadb").mkdir()
         
         # Hash password if provided
         password_hash = None
         if password:
-            password_hash = hashlib.sha256(password.encode()).hexdigest()
+            password_hash = self._hash_password(password)
 
         # Save metadata
         metadata = {
@@ -63,32 +102,50 @@ class RoomService:
             "password_hash": password_hash
         }
         
-        with open(room_path / "metadata.json", "w") as f:
-            json.dump(metadata, f, indent=2)
+        self._save_metadata(room_id, metadata)
             
         print(f"[ROOM] Created new room: {event_name} ({room_id})")
         return metadata
 
-    def get_room(self, room_id: str) -> Optional[Dict]:
-        """Validate if a room exists and return its metadata."""
+    def get_room(self, room_id: str, fresh: bool = False) -> Optional[Dict]:
+        """
+        Validate if a room exists and return its metadata.
+        
+        Args:
+            room_id: Room ID (case insensitive)
+            fresh: Read metadata.json even if cached. The cache is per process,
+                   so other workers may hold a copy up to _ROOM_CACHE_TTL old
+        """
         if not room_id:
             return None
             
-        room_path = ROOMS_DIR / room_id.upper() # Case insensitive ID
+        room_id = room_id.upper() # Case insensitive ID
+        if not fresh:
+            with self._room_cache_lock:
+                cached = self._room_cache.get(room_id)
+            if cached is not None:
+                return dict(cached)
+        
+        room_path = ROOMS_DIR / room_id
         meta_path = room_path / "metadata.json"
         
         if not room_path.exists() or not meta_path.exists():
             return None
             
         try:
-            with open(meta_path, "r") as f:
-                return json.load(f)
+            with open(meta_path, "rb") as f:
+                metadata = _load_json(f.read())
         except Exception:
             return None
+        
+        with self._room_cache_lock:
+            self._room_cache[room_id] = metadata
+        return dict(metadata)
 
-    def verify_password(self, room_id: str, password: str) -> bool:
-        """Verify room password."""
-        room = self.get_room(room_id)
+    def verify_password(self, room_id: str, password: Union[str, bytes]) -> bool:
+        """Verify room password (str, or bytes already UTF-8 encoded by the caller)."""
+        # Bypass the cache: a password changed through another worker must apply now
+        room = self.get_room(room_id, fresh=True)
         if not room:
             return False
             
@@ -104,8 +161,31 @@ class RoomService:
         if not password:
             return False # Password required but not provided
             
-        input_hash = hashlib.sha256(password.encode()).hexdigest()
-        return input_hash == stored_hash
+        # Encode once; every hash below works on the same bytes
+        password = _to_bytes(password)
+        
+        if stored_hash.startswith("$2"):
+            return bcrypt.checkpw(password, stored_hash.encode())
+        
+        # Legacy rooms store an unsalted SHA-256 hex digest; upgrade on success
+        input_hash = hashlib.sha256(password).hexdigest()
+        if not hmac.compare_digest(input_hash, stored_hash):
+            return False
+        room["password_hash"] = self._hash_password(password)
+        self._save_metadata(room_id, room)
+        return True
+    
+    @staticmethod
+    def _hash_password(password: Union[str, bytes]) -> str:
+        """Hash a room password with bcrypt (salted, deliberately slow)."""
+        return bcrypt.hashpw(_to_bytes(password), bcrypt.gensalt(rounds=12)).decode()
+    
+    def _save_metadata(self, room_id: str, metadata: Dict):
+        """Write a room's metadata.json (and refresh the cached copy)."""
+        with open(self.get_room_path(room_id) / "metadata.json", "wb") as f:
+            f.write(_dump_json(metadata))
+        with self._room_cache_lock:
+            self._room_cache[room_id.upper()] = dict(metadata)
 
     def get_room_path(self, room_id: str) -> Optional[Path]:
         """Get the absolute path to a room's data directory."""
@@ -9,18 +9,24 @@ This script implements the complete training pipeline:
 
 import os
 import sys
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 import numpy as np
 import torch
 import torch.nn as nn
 import torch.optim as optim
-from torch.utils.data import Dataset, DataLoader, random_split
+from torch.utils.data import Dataset
 from sklearn.metrics import classification_report, confusion_matrix
 from sklearn.model_selection import train_test_split
+import matplotlib
+matplotlib.use('Agg')  # file output only; no GUI backend
 import matplotlib.pyplot as plt
 import seaborn as sns
 from tqdm import tqdm
 import json
+import csv
+import hashlib
 from datetime import datetime
 
 
@@ -33,29 +39,130 @@ from models.custom_classifier import FaceClassifier
 from utils.image_processing import load_image, crop_face, preprocess_face
 import config
 
+# Fixed (BATCH_SIZE, 1024) inputs: let cuDNN benchmark and keep the fastest kernels
+torch.backends.cudnn.benchmark = True
+
 
 class FaceDataset(Dataset):
     """Custom dataset for face embeddings."""
     
-    def __init__(self, embeddings, labels):
-        self.embeddings = torch.FloatTensor(embeddings)
-        self.labels = torch.LongTensor(labels)
+    def __init__(self, embeddings, labels, device=None):
+        # Held on the training device once; batches are index slices
+        self.embeddings = torch.as_tensor(embeddings, dtype=torch.float32, device=device)
+        self.labels = torch.as_tensor(labels, dtype=torch.long, device=device)
     
     def __len__(self):
         return len(self.labels)
     
     def __getitem__(self, idx):
         return self.embeddings[idx], self.labels[idx]
+    
+    def num_batches(self, batch_size, drop_last=False):
+        """Number of batches iter_batches() yields."""
+        if drop_last and len(self) >= batch_size:
+            return len(self) // batch_size
+        return -(-len(self) // batch_size)
+    
+    def iter_batches(self, batch_size, shuffle=False, drop_last=False):
+        """
+        Yield (embeddings, labels) mini-batches by slicing the resident tensors.
+        
+        Args:
+            batch_size: Samples per batch
+            shuffle: Draw a new random order for this pass
+            drop_last: Skip a trailing partial batch (BatchNorm can't train on 1 sample)
+        """
+        n = len(self)
+        if shuffle:
+            order = torch.randperm(n, device=self.labels.device)
+            for idx in order[:self.num_batches(batch_size, drop_last) * batch_size].split(batch_size):
+                yield self.embeddings[idx], self.labels[idx]
+        else:
+            stop = min(self.num_batches(batch_size, drop_last) * batch_size, n)
+            for start in range(0, stop, batch_size):
+                yield self.embeddings[start:start + batch_size], self.labels[start:start + batch_size]
+
+
+# Image files picked up from each person folder (compared lower-case)
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png'}
+
+# Faces per batched embedding forward pass in load_training_data
+EMBEDDING_BATCH_SIZE = 64
+
+# Per-process face detector for the load_training_data worker pool
+_worker_detector = None
+
+
+def _init_detect_worker():
+    """Build the face detector once in each worker process."""
+    global _worker_detector
+    _worker_detector = FaceDetector()
+
+
+def _detect_one(job, face_detector=None):
+    """
+    Load an image, detect its first face and preprocess the crop.
+    
+    Args:
+        job: (label_idx, image path) tuple
+        face_detector: Detector to use (defaults to the worker's own)
+    
+    Returns:
+        (label_idx, image path, preprocessed face), or (label_idx, image path, None)
+        when the image can't be loaded or has no face
+    """
+    label_idx, img_path = job
+    detector = face_detector or _worker_detector
+    
+    image = load_image(str(img_path))
+    if image is None:
+        return label_idx, img_path, None
+    
+    faces = detector.detect_faces(image)
+    if not faces:
+        print(f"  ⚠️  No face detected in {img_path.name}")
+        return label_idx, img_path, None
+    
+    # Use the first (largest) face
+    bbox, confidence = faces[0]
+    face_img = crop_face(image, bbox)
+    if face_img is None:
+        return label_idx, img_path, None
+    
+    return label_idx, img_path, preprocess_face(face_img, config.FACE_SIZE)
+
+
+def _embedding_cache_path(cache_dir, jobs, model_version):
+    """
+    Cache file for a dataset's embeddings.
+    
+    The key covers every image (path, size, mtime) and the embedding model,
+    so adding/editing photos or switching models produces a new file.
+    """
+    h = hashlib.sha1(model_version.encode())
+    for label_idx, img_path in jobs:
+        st = img_path.stat()
+        h.update(f"{label_idx}|{img_path}|{st.st_size}|{st.st_mtime_ns}\n".encode())
+    return Path(cache_dir) / f"embeddings_{h.hexdigest()[:16]}.npz"
 
 
-def load_training_data(dataset_path, face_detector, face_recognizer):
+def load_training_data(dataset_path, face_detector, face_recognizer, num_workers=None, embedder=None,
+                       cache_dir=None):
     """
     Load images from dataset folders and extract embeddings.
     
+    Image decoding and face detection run in a process pool; embeddings are
+    generated in this process, EMBEDDING_BATCH_SIZE faces per forward pass.
+    
     Args:
         dataset_path: Path to training_dataset folder
-        face_detector: Face detection model
+        face_detector: Face detection model (used directly when num_workers <= 1)
         face_recognizer: Face recognition model (for embeddings)
+        num_workers: Detection processes (default: os.cpu_count())
+        embedder: Optional fused detect+embed model (InsightFaceEmbedder); when
+                  given, face_detector/face_recognizer are not used
+        cache_dir: Directory for reusing extracted embeddings across runs
+                   (skips detection and embedding when nothing changed)
     
     Returns:
         embeddings: List of face embeddings
@@ -68,7 +175,8 @@ def load_training_data(dataset_path, face_detector, face_recognizer):
     image_paths = []
     
     # Get all person folders
-    person_folders = sorted([f for f in dataset_path.iterdir() if f.is_dir()])
+    with os.scandir(dataset_path) as entries:
+        person_folders = sorted(Path(e.path) for e in entries if e.is_dir())
     
     if not person_folders:
         raise ValueError(f"No person folders found in {dataset_path}")
@@ -77,52 +185,91 @@ def load_training_data(dataset_path, face_detector, face_recognizer):
     print(f"LOADING TRAINING DATA")
     print(f"{'='*60}\n")
     
+    jobs = []
     for label_idx, person_folder in enumerate(person_folders):
         person_name = person_folder.name
         label_map[label_idx] = person_name
         
-        # Get all images in this person's folder
-        image_files = set()
-        for ext in ['*.jpg', '*.jpeg', '*.png', '*.JPG', '*.JPEG', '*.PNG']:
-            image_files.update(person_folder.glob(ext))
-        image_files = list(image_files)
+        # Get all images in this person's folder (one directory pass)
+        with os.scandir(person_folder) as entries:
+            image_files = [
+                Path(e.path) for e in entries
+                if e.is_file() and os.path.splitext(e.name)[1].lower() in IMAGE_EXTENSIONS
+            ]
         
         if not image_files:
             print(f"⚠️  WARNING: No images found for {person_name}")
             continue
         
-        print(f"📁 Processing {person_name}: {len(image_files)} images")
-        
-        person_embeddings = 0
-        for img_path in tqdm(image_files, desc=f"  Extracting embeddings"):
-            # Load image
-            image = load_image(str(img_path))
-            if image is None:
-                continue
-            
-            # Detect faces
-            faces = face_detector.detect_faces(image)
-            if not faces:
-                print(f"  ⚠️  No face detected in {img_path.name}")
-                continue
-            
-            # Use the first (largest) face
-            bbox, confidence = faces[0]
-            face_img = crop_face(image, bbox)
-            if face_img is None:
-                continue
-            
-            # Preprocess and generate embedding
-            preprocessed = preprocess_face(face_img, config.FACE_SIZE)
-            embedding = face_recognizer.generate_embedding(preprocessed, enable_tta=True)
-            
+        print(f"📁 {person_name}: {len(image_files)} images")
+        jobs.extend((label_idx, img_path) for img_path in sorted(image_files))
+    
+    cache_path = None
+    if cache_dir is not None:
+        model_version = (embedder or face_recognizer).model_version
+        cache_path = _embedding_cache_path(cache_dir, jobs, model_version)
+        if cache_path.exists():
+            print(f"\n✓ Reusing cached embeddings from {cache_path.name}\n")
+            with np.load(cache_path) as cached:
+                return (
+                    cached['embeddings'],
+                    cached['labels'],
+                    {int(k): v for k, v in json.loads(str(cached['label_map'])).items()},
+                    cached['image_paths'].tolist()
+                )
+    
+    num_workers = num_workers or os.cpu_count() or 1
+    per_person = [0] * len(person_folders)
+    
+    pending = []
+    
+    def _flush():
+        # One batched forward (TTA flips included) for all pending faces
+        batch_embeddings = face_recognizer.generate_embeddings_batch(
+            [face for _, _, face in pending], enable_tta=True
+        )
+        for (label_idx, img_path, _), embedding in zip(pending, batch_embeddings):
             if embedding is not None:
                 embeddings.append(embedding)
                 labels.append(label_idx)
                 image_paths.append(str(img_path))
-                person_embeddings += 1
-        
-        print(f"  ✓ Extracted {person_embeddings} embeddings for {person_name}\n")
+                per_person[label_idx] += 1
+        pending.clear()
+    
+    def _collect(results):
+        for result in tqdm(results, total=len(jobs), desc="  Extracting embeddings"):
+            if result[2] is None:
+                continue
+            pending.append(result)
+            if len(pending) >= EMBEDDING_BATCH_SIZE:
+                _flush()
+        if pending:
+            _flush()
+    
+    if embedder is not None:
+        # Detection and embedding in a single model call per image
+        for label_idx, img_path in tqdm(jobs, desc="  Extracting embeddings"):
+            embedding = embedder.embed_image(load_image(str(img_path)))
+            if embedding is None:
+                print(f"  ⚠️  No face detected in {img_path.name}")
+                continue
+            embeddings.append(embedding)
+            labels.append(label_idx)
+            image_paths.append(str(img_path))
+            per_person[label_idx] += 1
+    elif num_workers <= 1:
+        _collect(_detect_one(job, face_detector) for job in jobs)
+    else:
+        # spawn: TensorFlow is already initialized here and doesn't survive fork
+        ctx = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=num_workers, mp_context=ctx,
+                                 initializer=_init_detect_worker) as ex:
+            _collect(ex.map(_detect_one, jobs, chunksize=8))
+    
+    print()
+    for label_idx, person_name in label_map.items():
+        print(f"  ✓ Extracted {per_person[label_idx]} embeddings for {person_name}")
+    print()
     
     if not embeddings:
         raise ValueError("No embeddings extracted! Please check your dataset.")
@@ -135,13 +282,28 @@ def load_training_data(dataset_path, face_detector, face_recognizer):
     print(f"Label mapping: {label_map}")
     print(f"{'='*60}\n")
     
-    return np.array(embeddings), np.array(labels), label_map, image_paths
+    embeddings, labels = np.array(embeddings), np.array(labels)
+    if cache_path is not None:
+        np.savez(
+            cache_path,
+            embeddings=embeddings,
+            labels=labels,
+            label_map=json.dumps(label_map),
+            image_paths=np.array(image_paths)
+        )
+        print(f"✓ Cached embeddings to {cache_path}\n")
+    
+    return embeddings, labels, label_map, image_paths
 
 
-def train_model(model, train_loader, val_loader, criterion, optimizer, num_epochs, device):
+def train_model(model, train_dataset, val_dataset, criterion, optimizer, num_epochs, batch_size):
     """
     Train the classifier.
     
+    Both datasets are expected to already live on the model's device. On GPUs
+    with bfloat16 support the forward pass and loss run under autocast
+    (parameters and optimizer state stay FP32; bf16 needs no GradScaler).
+    
     Returns:
         train_losses: List of training losses per epoch
         val_losses: List of validation losses per epoch
@@ -153,6 +315,9 @@ def train_model(model, train_loader, val_loader, criterion, optimizer, num_epoch
     train_accs = []
     val_accs = []
     
+    device = train_dataset.labels.device
+    use_amp = device.type == 'cuda' and torch.cuda.is_bf16_supported()
+    
     print(f"\n{'='*60}")
     print(f"TRAINING STARTED")
     print(f"{'='*60}\n")
@@ -160,52 +325,50 @@ def train_model(model, train_loader, val_loader, criterion, optimizer, num_epoch
     for epoch in range(num_epochs):
         # Training phase
         model.train()
-        running_loss = 0.0
-        correct = 0
+        # Accumulated on the device; read back once per epoch (.item() syncs the GPU)
+        running_loss = torch.zeros((), device=device)
+        correct = torch.zeros((), dtype=torch.long, device=device)
         total = 0
         
-        for embeddings, labels in train_loader:
-            embeddings, labels = embeddings.to(device), labels.to(device)
-            
+        for embeddings, labels in train_dataset.iter_batches(batch_size, shuffle=True, drop_last=True):
             # Forward pass
             optimizer.zero_grad()
-            outputs = model(embeddings)
-            loss = criterion(outputs, labels)
+            with torch.autocast(device.type, dtype=torch.bfloat16, enabled=use_amp):
+                outputs = model(embeddings)
+                loss = criterion(outputs, labels)
             
             # Backward pass
             loss.backward()
             optimizer.step()
             
             # Statistics
-            running_loss += loss.item()
-            _, predicted = torch.max(outputs.data, 1)
+            running_loss += loss.detach()
+            correct += (outputs.detach().argmax(1) == labels).sum()
             total += labels.size(0)
-            correct += (predicted == labels).sum().item()
         
-        train_loss = running_loss / len(train_loader)
-        train_acc = 100 * correct / total
+        train_loss = running_loss.item() / train_dataset.num_batches(batch_size, drop_last=True)
+        train_acc = 100 * correct.item() / total
         train_losses.append(train_loss)
         train_accs.append(train_acc)
         
         # Validation phase
         model.eval()
-        val_running_loss = 0.0
-        val_correct = 0
+        val_running_loss = torch.zeros((), device=device)
+        val_correct = torch.zeros((), dtype=torch.long, device=device)
         val_total = 0
         
         with torch.no_grad():
-            for embeddings, labels in val_loader:
-                embeddings, labels = embeddings.to(device), labels.to(device)
-                outputs = model(embeddings)
-                loss = criterion(outputs, labels)
+            for embeddings, labels in val_dataset.iter_batches(batch_size):
+                with torch.autocast(device.type, dtype=torch.bfloat16, enabled=use_amp):
+                    outputs = model(embeddings)
+                    loss = criterion(outputs, labels)
                 
-                val_running_loss += loss.item()
-                _, predicted = torch.max(outputs.data, 1)
+                val_running_loss += loss
+                val_correct += (outputs.argmax(1) == labels).sum()
                 val_total += labels.size(0)
-                val_correct += (predicted == labels).sum().item()
         
-        val_loss = val_running_loss / len(val_loader)
-        val_acc = 100 * val_correct / val_total
+        val_loss = val_running_loss.item() / val_dataset.num_batches(batch_size)
+        val_acc = 100 * val_correct.item() / val_total
         val_losses.append(val_loss)
         val_accs.append(val_acc)
         
@@ -244,11 +407,20 @@ def save_training_plots(train_losses, val_losses, train_accs, val_accs, save_dir
     ax2.legend()
     ax2.grid(True, alpha=0.3)
     
-    plt.tight_layout()
+    # tight_layout already fits the labels; bbox_inches='tight' would cost an extra render
+    fig.tight_layout()
     plot_path = save_dir / 'training_curves.png'
-    plt.savefig(plot_path, dpi=300, bbox_inches='tight')
+    fig.savefig(plot_path, dpi=120)
     print(f"✓ Saved training curves to {plot_path}")
-    plt.close()
+    plt.close(fig)
+    
+    # Raw values, so the curves can be re-plotted without re-running training
+    csv_path = save_dir / 'training_curves.csv'
+    with open(csv_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['epoch', 'train_loss', 'val_loss', 'train_acc', 'val_acc'])
+        writer.writerows(zip(epochs, train_losses, val_losses, train_accs, val_accs))
+    print(f"✓ Saved training curves data to {csv_path}")
 
 
 def main():
@@ -264,20 +436,38 @@ def main():
     LEARNING_RATE = 0.001
     TEST_SPLIT = 0.15
     VAL_SPLIT_OF_REMAINING = 0.1764 # ~15% of total dataset
-    
-    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    # "deepface" (same Super-Ensemble as photo search) or "insightface" (fused buffalo pack)
+    EMBEDDER = os.getenv("TRAIN_EMBEDDER", "deepface").lower()
+    
+    # Apple Silicon: the MPS backend is much faster than CPU BLAS for the MLP
+    if torch.cuda.is_available():
+        device = torch.device('cuda')
+    elif torch.backends.mps.is_available():
+        device = torch.device('mps')
+    else:
+        device = torch.device('cpu')
+    # Allow TF32 matmuls on GPUs that have them
+    torch.set_float32_matmul_precision('high')
     print(f"\n🖥️  Using device: {device}\n")
     
     # Initialize models
     print("Loading pre-trained models...")
-    face_detector = FaceDetector()
-    face_recognizer = get_facenet_model()
+    face_detector = face_recognizer = embedder = None
+    if EMBEDDER == "insightface":
+        from models.insightface_embedder import InsightFaceEmbedder
+        embedder = InsightFaceEmbedder(use_gpu=device.type == 'cuda')
+    else:
+        face_detector = FaceDetector()
+        face_recognizer = get_facenet_model()
+        # Batched embedding extraction through ONNX Runtime (falls back to TensorFlow)
+        face_recognizer.enable_onnx(OUTPUT_DIR / "onnx", use_gpu=device.type == 'cuda')
     print("✓ Models loaded\n")
     
     # Load and process dataset
     embeddings, labels, label_map, image_paths = load_training_data(
-        DATASET_PATH, face_detector, face_recognizer
+        DATASET_PATH, face_detector, face_recognizer, embedder=embedder, cache_dir=OUTPUT_DIR
     )
+    input_dim = embeddings.shape[1]
     
     # 3-way split: 70% Train, 15% Val, 15% Test
     emb_train_val, emb_test, lab_train_val, lab_test, path_train_val, path_test = train_test_split(
@@ -288,12 +478,10 @@ def main():
         emb_train_val, lab_train_val, path_train_val, test_size=VAL_SPLIT_OF_REMAINING, random_state=42, stratify=lab_train_val
     )
     
-    # Create dataset objects
-    train_dataset = FaceDataset(emb_train, lab_train)
-    val_dataset = FaceDataset(emb_val, lab_val)
-    
-    train_loader = DataLoader(train_dataset, batch_size=BATCH_SIZE, shuffle=True)
-    val_loader = DataLoader(val_dataset, batch_size=BATCH_SIZE, shuffle=False)
+    # Create dataset objects (the embeddings are small: keep them on the device
+    # and slice batches instead of collating them through a DataLoader)
+    train_dataset = FaceDataset(emb_train, lab_train, device=device)
+    val_dataset = FaceDataset(emb_val, lab_val, device=device)
     
     print(f"Train samples: {len(train_dataset)}")
     print(f"Validation samples: {len(val_dataset)}")
@@ -301,15 +489,23 @@ def main():
     
     # Initialize classifier
     num_classes = len(label_map)
-    model = FaceClassifier(input_dim=1024, num_classes=num_classes).to(device)
+    model = FaceClassifier(input_dim=input_dim, num_classes=num_classes).to(device)
     criterion = nn.CrossEntropyLoss()
     optimizer = optim.Adam(model.parameters(), lr=LEARNING_RATE, weight_decay=1e-4)
     
     print(f"Model architecture:\n{model}\n")
     
+    # Fuse the MLP into compiled kernels on GPU (CPU inductor needs a C++ toolchain);
+    # `model` keeps the plain module so the saved state_dict keys are unchanged.
+    # Default mode, not 'reduce-overhead': its CUDA graphs reuse output buffers
+    # across steps, which would corrupt the on-device loss/accuracy accumulators
+    train_net = model
+    if device.type == 'cuda':
+        train_net = torch.compile(model)
+    
     # Train
     train_losses, val_losses, train_accs, val_accs = train_model(
-        model, train_loader, val_loader, criterion, optimizer, NUM_EPOCHS, device
+        train_net, train_dataset, val_dataset, criterion, optimizer, NUM_EPOCHS, BATCH_SIZE
     )
     
     # Save model
@@ -320,7 +516,8 @@ def main():
         'model_state_dict': model.state_dict(),
         'label_map': label_map,
         'num_classes': num_classes,
-        'input_dim': 1024,
+        'input_dim': input_dim,
+        'embedder': EMBEDDER,
         'train_acc': train_accs[-1],
         'val_acc': val_accs[-1]
     }, model_path)
@@ -333,6 +530,7 @@ def main():
     # Save training log
     log_data = {
         'timestamp': timestamp,
+        'embedder': EMBEDDER,
         'num_epochs': NUM_EPOCHS,
         'batch_size': BATCH_SIZE,
         'learning_rate': LEARNING_RATE,
@@ -4,13 +4,114 @@ Extracts GPS location, timestamp, and other metadata from images.
 """
 
 from PIL import Image
-from PIL.ExifTags import TAGS, GPSTAGS
-from typing import Dict, Optional, Tuple
+from PIL.ExifTags import GPSTAGS
+from typing import Dict, List, Optional, Tuple
 from pathlib import Path
+from datetime import datetime
+from functools import lru_cache
 import logging
 
+import numpy as np
+
+try:
+    import exifread
+except ImportError:  # PIL is used instead (slower: builds the full tag dict)
+    exifread = None
+
 logger = logging.getLogger(__name__)
 
+# EXIF tag ids read by the PIL fallback
+_TAG_MAKE = 0x010F
+_TAG_MODEL = 0x0110
+_TAG_DATETIME = 0x0132
+_TAG_DATETIME_ORIGINAL = 0x9003
+_EXIF_IFD_POINTER = 0x8769
+_GPS_IFD_POINTER = 0x8825
+
+# exifread tag name -> GPS field used by _get_decimal_coordinates
+_EXIFREAD_GPS_TAGS = {
+    'GPS GPSLatitude': 'GPSLatitude',
+    'GPS GPSLatitudeRef': 'GPSLatitudeRef',
+    'GPS GPSLongitude': 'GPSLongitude',
+    'GPS GPSLongitudeRef': 'GPSLongitudeRef',
+    'GPS GPSAltitude': 'GPSAltitude',
+}
+
+
+# reverse_geocoder module, resolved once (None when not installed)
+_reverse_geocoder = None
+_reverse_geocoder_checked = False
+
+# Coordinates are rounded to this many decimals (~100 m) before lookup, so
+# photos from the same place share one cached result
+_GEOCODE_DECIMALS = 3
+
+
+def _get_reverse_geocoder():
+    """Import reverse_geocoder on first use and remember the outcome."""
+    global _reverse_geocoder, _reverse_geocoder_checked
+    if not _reverse_geocoder_checked:
+        try:
+            import reverse_geocoder
+            _reverse_geocoder = reverse_geocoder
+        except ImportError:
+            logger.warning("reverse_geocoder not installed. Install with: pip install reverse_geocoder")
+        _reverse_geocoder_checked = True
+    return _reverse_geocoder
+
+
+@lru_cache(maxsize=4096)
+def _lookup_location(lat_key: float, lon_key: float) -> Optional[str]:
+    """Offline lookup of a rounded coordinate (cached)."""
+    result = _get_reverse_geocoder().search((lat_key, lon_key), mode=1)  # mode=1 = single result
+    if result:
+        return EXIFExtractor._format_location(result[0])
+    return None
+
+
+# Degrees, minutes, seconds -> degrees
+_DMS_SCALE = np.array([1.0, 1 / 60, 1 / 3600])
+
+
+def _dms_to_degrees(dms, ref: str) -> float:
+    """Convert one (degrees, minutes, seconds) triple; 'S'/'W' are negative."""
+    degrees = float(np.dot(np.asarray(dms, dtype=np.float64), _DMS_SCALE))
+    return -degrees if ref in ('S', 'W') else degrees
+
+
+def parse_exif_timestamp(timestamp: str) -> Optional[datetime]:
+    """
+    Parse an EXIF timestamp ("YYYY:MM:DD HH:MM:SS").
+    
+    The fixed EXIF layout is sliced and converted with int() directly;
+    strptime and then the (much slower) dateutil parser are only tried
+    for non-conforming values.
+    
+    Args:
+        timestamp: Timestamp string from EXIF
+        
+    Returns:
+        Parsed datetime, or None if it cannot be parsed
+    """
+    if not timestamp:
+        return None
+    s = timestamp
+    if len(s) >= 19 and s[4] == ':' and s[7] == ':' and s[10] == ' ' and s[13] == ':' and s[16] == ':':
+        try:
+            return datetime(int(s[0:4]), int(s[5:7]), int(s[8:10]),
+                            int(s[11:13]), int(s[14:16]), int(s[17:19]))
+        except ValueError:
+            pass
+    try:
+        return datetime.strptime(s[:19], "%Y:%m:%d %H:%M:%S")
+    except ValueError:
+        pass
+    try:
+        from dateutil import parser as date_parser
+        return date_parser.parse(timestamp.replace(':', '-', 2))
+    except (ValueError, OverflowError):
+        return None
+
 
 class EXIFExtractor:
     """Extract EXIF metadata from images."""
@@ -26,33 +127,16 @@ class EXIFExtractor:
         Returns:
             Tuple of (latitude, longitude) in decimal format, or None
         """
-        try:
-            # Get latitude
-            lat_deg = gps_info.get('GPSLatitude')
-            lat_ref = gps_info.get('GPSLatitudeRef')
-            
-            # Get longitude
-            lon_deg = gps_info.get('GPSLongitude')
-            lon_ref = gps_info.get('GPSLongitudeRef')
-            
-            if not all([lat_deg, lat_ref, lon_deg, lon_ref]):
-                return None
-            
-            # Convert to decimal
-            lat = lat_deg[0] + lat_deg[1] / 60 + lat_deg[2] / 3600
-            lon = lon_deg[0] + lon_deg[1] / 60 + lon_deg[2] / 3600
-            
-            # Apply direction (N/S, E/W)
-            if lat_ref == 'S':
-                lat = -lat
-            if lon_ref == 'W':
-                lon = -lon
-                
-            return (lat, lon)
-            
-        except Exception as e:
-            logger.warning(f"Failed to parse GPS coordinates: {e}")
+        lat_deg = gps_info.get('GPSLatitude')
+        lat_ref = gps_info.get('GPSLatitudeRef')
+        lon_deg = gps_info.get('GPSLongitude')
+        lon_ref = gps_info.get('GPSLongitudeRef')
+        
+        if not (lat_deg and lat_ref and lon_deg and lon_ref):
             return None
+        
+        # Malformed values raise; extract_metadata logs them
+        return (_dms_to_degrees(lat_deg, lat_ref), _dms_to_degrees(lon_deg, lon_ref))
     
     @staticmethod
     def extract_metadata(image_path: str) -> Dict:
@@ -87,40 +171,31 @@ class EXIFExtractor:
         }
         
         try:
-            image = Image.open(image_path)
-            exif_data = image._getexif()
+            if exifread is not None:
+                tags = EXIFExtractor._read_tags_exifread(image_path)
+            else:
+                tags = EXIFExtractor._read_tags_pil(image_path)
             
-            if not exif_data:
+            if not tags:
                 logger.info(f"No EXIF data found in {Path(image_path).name}")
                 return metadata
             
-            # Parse standard EXIF tags
-            for tag_id, value in exif_data.items():
-                tag_name = TAGS.get(tag_id, tag_id)
-                
-                if tag_name == 'DateTime' or tag_name == 'DateTimeOriginal':
-                    metadata['timestamp'] = str(value)
-                elif tag_name == 'Make':
-                    metadata['camera_make'] = str(value)
-                elif tag_name == 'Model':
-                    metadata['camera_model'] = str(value)
-                elif tag_name == 'GPSInfo':
-                    # Parse GPS data
-                    gps_info = {}
-                    for gps_tag_id, gps_value in value.items():
-                        gps_tag_name = GPSTAGS.get(gps_tag_id, gps_tag_id)
-                        gps_info[gps_tag_name] = gps_value
+            timestamp, make, model, gps_info = tags
+            metadata['timestamp'] = timestamp
+            metadata['camera_make'] = make
+            metadata['camera_model'] = model
+            
+            if gps_info:
+                # Extract coordinates
+                coords = EXIFExtractor._get_decimal_coordinates(gps_info)
+                if coords:
+                    metadata['has_location'] = True
+                    metadata['latitude'] = coords[0]
+                    metadata['longitude'] = coords[1]
                     
-                    # Extract coordinates
-                    coords = EXIFExtractor._get_decimal_coordinates(gps_info)
-                    if coords:
-                        metadata['has_location'] = True
-                        metadata['latitude'] = coords[0]
-                        metadata['longitude'] = coords[1]
-                        
-                        # Extract altitude if available
-                        if 'GPSAltitude' in gps_info:
-                            metadata['altitude'] = float(gps_info['GPSAltitude'])
+                    # Extract altitude if available
+                    if 'GPSAltitude' in gps_info:
+                        metadata['altitude'] = float(gps_info['GPSAltitude'])
             
             logger.info(f"Extracted metadata from {Path(image_path).name}: "
                        f"Location={'Yes' if metadata['has_location'] else 'No'}, "
@@ -131,6 +206,72 @@ class EXIFExtractor:
         
         return metadata
     
+    @staticmethod
+    def _read_tags_exifread(image_path: str) -> Optional[Tuple]:
+        """
+        Read the needed tags with exifread (parses only the EXIF segment).
+        
+        Returns:
+            (timestamp, make, model, gps_info) or None if the file has no EXIF
+        """
+        with open(image_path, 'rb') as f:
+            # GPSInfo is the last IFD0 tag we need; its sub-IFD is read on the way
+            tags = exifread.process_file(f, stop_tag='GPSInfo', details=False)
+        
+        if not tags:
+            return None
+        
+        timestamp = tags.get('EXIF DateTimeOriginal') or tags.get('Image DateTime')
+        make = tags.get('Image Make')
+        model = tags.get('Image Model')
+        
+        gps_info = {}
+        for tag_name, field in _EXIFREAD_GPS_TAGS.items():
+            tag = tags.get(tag_name)
+            if tag is None:
+                continue
+            if field.endswith('Ref'):
+                gps_info[field] = str(tag.values)
+            elif field == 'GPSAltitude':
+                gps_info[field] = float(tag.values[0])
+            else:
+                gps_info[field] = [float(v) for v in tag.values]
+        
+        return (
+            str(timestamp) if timestamp else None,
+            str(make) if make else None,
+            str(model) if model else None,
+            gps_info
+        )
+    
+    @staticmethod
+    def _read_tags_pil(image_path: str) -> Optional[Tuple]:
+        """
+        Read the needed tags with PIL (fallback when exifread is not installed).
+        
+        Returns:
+            (timestamp, make, model, gps_info) or None if the file has no EXIF
+        """
+        # getexif() parses IFD0 only; the Exif and GPS sub-IFDs are read on demand
+        with Image.open(image_path) as image:
+            exif = image.getexif()
+            if not exif:
+                return None
+            exif_ifd = exif.get_ifd(_EXIF_IFD_POINTER)
+            gps_ifd = exif.get_ifd(_GPS_IFD_POINTER)
+        
+        timestamp = exif_ifd.get(_TAG_DATETIME_ORIGINAL) or exif.get(_TAG_DATETIME)
+        make = exif.get(_TAG_MAKE)
+        model = exif.get(_TAG_MODEL)
+        gps_info = {GPSTAGS.get(tag_id, tag_id): value for tag_id, value in gps_ifd.items()}
+        
+        return (
+            str(timestamp) if timestamp else None,
+            str(make) if make else None,
+            str(model) if model else None,
+            gps_info
+        )
+    
     @staticmethod
     def reverse_geocode(latitude: float, longitude: float) -> Optional[str]:
         """
@@ -144,32 +285,7 @@ class EXIFExtractor:
         Returns:
             Location name string (City, State, Country), or None if failed
         """
-        try:
-            import reverse_geocoder as rg
-            
-            # Query offline database
-            result = rg.search((latitude, longitude), mode=1)  # mode=1 = single result
-            
-            if result and len(result) > 0:
-                location = result[0]
-                # Build location string: City, State, Country
-                parts = []
-                
-                if location.get('name'):  # City name
-                    parts.append(location['name'])
-                if location.get('admin1'):  # State/Province
-                    parts.append(location['admin1'])
-                if location.get('cc'):  # Country code
-                    parts.append(location['cc'])
-                
-                location_str = ', '.join(parts)
-                logger.info(f"Reverse geocoded ({latitude:.4f}, {longitude:.4f}) -> {location_str}")
-                return location_str
-            
-            return None
-            
-        except ImportError:
-            logger.warning("reverse_geocoder not installed. Install with: pip install reverse_geocoder")
+        if _get_reverse_geocoder() is None:
             # Fallback to geopy (online, slower)
             try:
                 from geopy.geocoders import Nominatim
@@ -180,11 +296,66 @@ class EXIFExtractor:
             except Exception as e:
                 logger.warning(f"Geopy fallback also failed: {e}")
             return None
+        
+        try:
+            # Query offline database
+            location_str = _lookup_location(
+                round(latitude, _GEOCODE_DECIMALS), round(longitude, _GEOCODE_DECIMALS)
+            )
+            if location_str:
+                logger.info(f"Reverse geocoded ({latitude:.4f}, {longitude:.4f}) -> {location_str}")
+            return location_str
             
         except Exception as e:
             logger.warning(f"Reverse geocoding failed: {e}")
             return None
     
+    @staticmethod
+    def _format_location(location: Dict) -> str:
+        """Build "City, State, Country" from a reverse_geocoder result."""
+        parts = []
+        
+        if location.get('name'):  # City name
+            parts.append(location['name'])
+        if location.get('admin1'):  # State/Province
+            parts.append(location['admin1'])
+        if location.get('cc'):  # Country code
+            parts.append(location['cc'])
+        
+        return ', '.join(parts)
+    
+    @staticmethod
+    def reverse_geocode_batch(coords) -> List[Optional[str]]:
+        """
+        Reverse geocode many points with a single k-d tree query.
+        
+        Args:
+            coords: (N, 2) array-like of (latitude, longitude)
+            
+        Returns:
+            Location names in input order (None where lookup failed)
+        """
+        coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+        if len(coords) == 0:
+            return []
+        
+        rg = _get_reverse_geocoder()
+        if rg is None:
+            # Online fallback can't batch; go point by point
+            return [EXIFExtractor.reverse_geocode(lat, lon) for lat, lon in coords]
+        
+        try:
+            # Query each ~100 m grid cell once
+            cells, inverse = np.unique(np.round(coords, _GEOCODE_DECIMALS), axis=0, return_inverse=True)
+            results = rg.search([tuple(point) for point in cells.tolist()], mode=1)
+            cell_names = [EXIFExtractor._format_location(r) if r else None for r in results]
+            names = [cell_names[i] for i in inverse.reshape(-1)]
+            logger.info(f"Reverse geocoded {len(names)} location(s) ({len(cells)} unique) in one batch")
+            return names
+        except Exception as e:
+            logger.warning(f"Batch reverse geocoding failed: {e}")
+            return [None] * len(coords)
+    
     @staticmethod
     def get_location_name(image_path: str) -> Optional[str]:
         """
@@ -3,11 +3,103 @@ Image processing utilities for PhotoScan application.
 Handles image loading, cropping, resizing, and normalization.
 """
 
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from functools import lru_cache
+
 import cv2
 import numpy as np
-from PIL import Image
 from pathlib import Path
-from typing import Tuple, Optional
+from typing import List, Tuple, Optional
+
+try:
+    from numba import njit
+except ImportError:  # optional: preprocess_face falls back to cv2.resize + LUT
+    njit = None
+
+logger = logging.getLogger(__name__)
+
+
+# Every uint8 pixel value mapped to its FaceNet input in [-1, 1]
+_FACENET_LUT = np.arange(256, dtype=np.float32) * np.float32(2.0 / 255.0) - np.float32(1.0)
+
+# Per-thread scratch buffers for the downsampled face in preprocess_face
+_resize_scratch = threading.local()
+
+# libjpeg-turbo decoder (PyTurboJPEG), created on first use; None when unavailable
+_turbojpeg = None
+_turbojpeg_checked = False
+_JPEG_MAGIC = b'\xff\xd8\xff'
+# DCT-domain downscale denominators libjpeg-turbo decodes for free, largest first
+_JPEG_SCALE_DENOMS = (8, 4, 2)
+
+# Per-thread pool of decode buffers: {(h, w, 3): deque of free arrays}
+_decode_pool = threading.local()
+_POOL_MAX_SHAPES = 8
+_POOL_BUFFERS_PER_SHAPE = 2
+
+# Output dtypes preprocess_face can emit (uint8 = raw pixels for quantized models)
+_PREPROCESS_DTYPES = (np.dtype(np.float32), np.dtype(np.float16), np.dtype(np.uint8))
+
+# FaceNet input size the numba kernel is specialized for
+_FACENET_SIZE = 160
+
+
+if njit is not None:
+    @njit(cache=True)
+    def _area_taps(src_len, dst_len):
+        """
+        Source taps for an area (box) downscale along one axis.
+
+        Output pixel i averages the source interval [i * scale, (i + 1) * scale),
+        weighting each overlapped source pixel by its covered fraction.
+
+        Returns:
+            (first source index, tap count, weights) per output pixel
+        """
+        scale = src_len / dst_len
+        max_taps = int(np.ceil(scale)) + 1
+        starts = np.empty(dst_len, np.int64)
+        counts = np.empty(dst_len, np.int64)
+        weights = np.zeros((dst_len, max_taps), np.float32)
+        for i in range(dst_len):
+            lo = i * scale
+            hi = min((i + 1) * scale, src_len)
+            first = int(lo)
+            last = min(int(np.ceil(hi)), src_len)
+            starts[i] = first
+            counts[i] = last - first
+            for j in range(first, last):
+                weights[i, j - first] = (min(j + 1, hi) - max(j, lo)) / scale
+        return starts, counts, weights
+
+    # Tap tables depend only on (crop side, output side), and crop sides repeat
+    # across faces; the kernel only reads them, so cached arrays can be shared
+    _cached_area_taps = lru_cache(maxsize=1024)(_area_taps)
+
+    @njit(fastmath=True, cache=True)
+    def _area_resize_normalize(src, y0, ny, wy, x0, nx, wx, dst):
+        # Separable box filter + x * (2/255) - 1 in one pass, no uint8 intermediate.
+        # Not parallel: callers already run faces concurrently and numba's default
+        # threading layer rejects concurrent launches from several threads.
+        for y in range(dst.shape[0]):
+            for x in range(dst.shape[1]):
+                r = np.float32(0.0)
+                g = np.float32(0.0)
+                b = np.float32(0.0)
+                for i in range(ny[y]):
+                    row = y0[y] + i
+                    for j in range(nx[x]):
+                        w = wy[y, i] * wx[x, j]
+                        col = x0[x] + j
+                        r += src[row, col, 0] * w
+                        g += src[row, col, 1] * w
+                        b += src[row, col, 2] * w
+                dst[y, x, 0] = r * np.float32(2.0 / 255.0) - np.float32(1.0)
+                dst[y, x, 1] = g * np.float32(2.0 / 255.0) - np.float32(1.0)
+                dst[y, x, 2] = b * np.float32(2.0 / 255.0) - np.float32(1.0)
 
 
 def load_image(image_path: str) -> Optional[np.ndarray]:
@@ -18,43 +110,155 @@ def load_image(image_path: str) -> Optional[np.ndarray]:
         image_path: Path to the image file
         
     Returns:
-        Image as numpy array in RGB format, or None if loading fails
+        Image as numpy array in RGB format, or None if loading fails.
+        The array is a negative-stride view over the decoded BGR buffer;
+        call np.ascontiguousarray on it if a consumer needs C order.
     """
     try:
         image = cv2.imread(str(image_path))
         if image is None:
             return None
-        # Convert BGR to RGB
-        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        return image
+        # BGR -> RGB as a zero-copy view (cvtColor fans a trivial swap out over every core)
+        return image[..., ::-1]
     except Exception as e:
-        print(f"Error loading image {image_path}: {e}")
+        logger.warning("Error loading image %s: %s", image_path, e)
         return None
 
 
-def load_image_from_bytes(image_bytes: bytes) -> Optional[np.ndarray]:
+def load_image_from_bytes(image_bytes: bytes, min_side: int = 0) -> Optional[np.ndarray]:
     """
     Load an image from bytes.
+    JPEGs are decoded by libjpeg-turbo straight to RGB when PyTurboJPEG is
+    installed, otherwise by OpenCV.
     
     Args:
         image_bytes: Image data as bytes
+        min_side: Decode JPEGs at the smallest DCT scale (1/2, 1/4, 1/8) that
+            keeps the shorter side at least this long (0 = full resolution;
+            libjpeg-turbo only)
         
     Returns:
-        Image as numpy array in RGB format, or None if loading fails
+        Image as numpy array in RGB format, or None if loading fails.
+        OpenCV-decoded arrays are a negative-stride view over the BGR buffer;
+        call np.ascontiguousarray on it if a consumer needs C order.
     """
+    jpeg = _get_turbojpeg() if image_bytes[:3] == _JPEG_MAGIC else None
+    if jpeg is not None:
+        try:
+            from turbojpeg import TJPF_RGB
+            width, height = jpeg.decode_header(image_bytes)[:2]
+            return jpeg.decode(
+                image_bytes,
+                pixel_format=TJPF_RGB,
+                scaling_factor=_jpeg_scaling_factor(width, height, min_side)
+            )
+        except Exception as e:
+            logger.warning("Error decoding JPEG with libjpeg-turbo, retrying with OpenCV: %s", e)
+
     try:
         nparr = np.frombuffer(image_bytes, np.uint8)
         image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
         if image is None:
             return None
-        # Convert BGR to RGB
-        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        return image
+        # BGR -> RGB as a zero-copy view (cvtColor fans a trivial swap out over every core)
+        return image[..., ::-1]
     except Exception as e:
-        print(f"Error loading image from bytes: {e}")
+        logger.warning("Error loading image from bytes: %s", e)
         return None
 
 
+def _jpeg_scaling_factor(width: int, height: int, min_side: int) -> Optional[Tuple[int, int]]:
+    """Largest libjpeg-turbo downscale keeping the shorter side >= min_side (None = full size)."""
+    if min_side > 0:
+        shorter = min(width, height)
+        for denom in _JPEG_SCALE_DENOMS:
+            if -(-shorter // denom) >= min_side:
+                return (1, denom)
+    return None
+
+
+def _get_turbojpeg():
+    """Load libjpeg-turbo on first use and remember the outcome."""
+    global _turbojpeg, _turbojpeg_checked
+    if not _turbojpeg_checked:
+        try:
+            from turbojpeg import TurboJPEG
+            _turbojpeg = TurboJPEG()
+        except ImportError:
+            pass  # optional: pip install PyTurboJPEG
+        except (OSError, RuntimeError) as e:
+            logger.warning("libjpeg-turbo unavailable, decoding with OpenCV: %s", e)
+        _turbojpeg_checked = True
+    return _turbojpeg
+
+
+def _acquire_buffer(shape: Tuple[int, int, int]) -> np.ndarray:
+    """Take a free uint8 buffer of this shape from the thread's pool (or allocate one)."""
+    pool = getattr(_decode_pool, 'buffers', None)
+    if pool is None:
+        pool = _decode_pool.buffers = {}
+    free = pool.get(shape)
+    if free:
+        return free.pop()
+    return np.empty(shape, np.uint8)
+
+
+def _release_buffer(buffer: np.ndarray):
+    """Return a buffer to the thread's pool, evicting the oldest shape when full."""
+    pool = getattr(_decode_pool, 'buffers', None)
+    if pool is None:
+        pool = _decode_pool.buffers = {}
+    free = pool.pop(buffer.shape, None)
+    if free is None:
+        if len(pool) >= _POOL_MAX_SHAPES:
+            del pool[next(iter(pool))]
+        free = deque(maxlen=_POOL_BUFFERS_PER_SHAPE)
+    free.append(buffer)
+    pool[buffer.shape] = free  # most recently used shape last
+
+
+@contextmanager
+def pooled_image_from_bytes(image_bytes: bytes, min_side: int = 0):
+    """
+    Decode an image into a reusable buffer for the duration of a with-block.
+    JPEGs are decoded straight to RGB by libjpeg-turbo into a per-thread pooled
+    buffer; other formats (or no PyTurboJPEG) fall back to OpenCV.
+    
+    Args:
+        image_bytes: Image data as bytes
+        min_side: JPEG DCT downscale bound, as in load_image_from_bytes
+        
+    Yields:
+        Image as numpy array in RGB format, or None if decoding fails.
+        The buffer is recycled when the block exits, so don't keep references
+        to it (or views of it) afterwards.
+    """
+    jpeg = _get_turbojpeg() if image_bytes[:3] == _JPEG_MAGIC else None
+    buffer = None
+    if jpeg is not None:
+        try:
+            from turbojpeg import TJPF_RGB
+            width, height = jpeg.decode_header(image_bytes)[:2]
+            scaling_factor = _jpeg_scaling_factor(width, height, min_side)
+            if scaling_factor is not None:
+                denom = scaling_factor[1]
+                width, height = -(-width // denom), -(-height // denom)
+            buffer = _acquire_buffer((height, width, 3))
+            jpeg.decode(image_bytes, pixel_format=TJPF_RGB, scaling_factor=scaling_factor, dst=buffer)
+        except Exception as e:
+            logger.warning("Error decoding JPEG with libjpeg-turbo, retrying with OpenCV: %s", e)
+            buffer = None
+
+    if buffer is None:
+        yield load_image_from_bytes(image_bytes, min_side)
+        return
+
+    try:
+        yield buffer
+    finally:
+        _release_buffer(buffer)
+
+
 def crop_face(image: np.ndarray, bbox: Tuple[int, int, int, int]) -> Optional[np.ndarray]:
     """
     Crop a face from an image using bounding box coordinates.
@@ -64,25 +268,43 @@ def crop_face(image: np.ndarray, bbox: Tuple[int, int, int, int]) -> Optional[np
         bbox: Bounding box as (x, y, width, height)
         
     Returns:
-        Cropped face image, or None if cropping fails
+        Cropped face image (a view into image), or None if the box lies outside it
     """
-    try:
-        x, y, w, h = bbox
-        # Ensure coordinates are within image bounds
-        height, width = image.shape[:2]
-        x = max(0, x)
-        y = max(0, y)
-        w = min(w, width - x)
-        h = min(h, height - y)
-        
-        if w <= 0 or h <= 0:
-            return None
-            
-        cropped = image[y:y+h, x:x+w]
-        return cropped
-    except Exception as e:
-        print(f"Error cropping face: {e}")
+    x, y, w, h = bbox
+    # Ensure coordinates are within image bounds
+    height, width = image.shape[:2]
+    x = x if x > 0 else 0
+    y = y if y > 0 else 0
+    w = width - x if w > width - x else w
+    h = height - y if h > height - y else h
+    
+    if w <= 0 or h <= 0:
         return None
+    
+    return image[y:y+h, x:x+w]
+
+
+def crop_faces(image: np.ndarray, bboxes) -> List[Optional[np.ndarray]]:
+    """
+    Crop several faces at once, clamping all boxes in one vectorized step.
+    
+    Args:
+        image: Input image as numpy array
+        bboxes: (N, 4) array-like of (x, y, width, height) boxes
+        
+    Returns:
+        One view per box (same clamping as crop_face), None where a box lies outside the image
+    """
+    boxes = np.asarray(bboxes, dtype=np.int64).reshape(-1, 4)
+    height, width = image.shape[:2]
+    origins = np.maximum(boxes[:, :2], 0)
+    sizes = np.minimum(boxes[:, 2:], np.array([width, height]) - origins)
+    ends = origins + sizes
+    valid = (sizes > 0).all(axis=1)
+    return [
+        image[y0:y1, x0:x1] if ok else None
+        for (x0, y0), (x1, y1), ok in zip(origins.tolist(), ends.tolist(), valid.tolist())
+    ]
 
 
 def resize_image(image: np.ndarray, target_size: Tuple[int, int]) -> np.ndarray:
@@ -99,24 +321,124 @@ def resize_image(image: np.ndarray, target_size: Tuple[int, int]) -> np.ndarray:
     return cv2.resize(image, target_size, interpolation=cv2.INTER_AREA)
 
 
-def normalize_image(image: np.ndarray) -> np.ndarray:
+def normalize_image(image: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
     """
     Normalize image pixel values to [-1, 1] range for FaceNet.
     
     Args:
         image: Input image as numpy array with values in [0, 255]
+        out: Optional C-contiguous float32 array of the same shape to write into
         
     Returns:
         Normalized image with values in [-1, 1]
     """
-    # Convert to float and normalize to [0, 1]
-    normalized = image.astype(np.float32) / 255.0
-    # Standardize to [-1, 1]
-    normalized = (normalized - 0.5) * 2.0
-    return normalized
+    if image.dtype == np.uint8:
+        # One table lookup per pixel instead of a float multiply and subtract
+        return cv2.LUT(image, _FACENET_LUT, dst=out)
+
+    # (x / 255 - 0.5) * 2 == x * (2 / 255) - 1 in one OpenCV pass into a float32
+    # output (OpenCV drops the GIL, so threads normalizing other faces overlap)
+    return cv2.addWeighted(image, 2.0 / 255.0, image, 0.0, -1.0, dst=out, dtype=cv2.CV_32F)
+
+
+def _scratch_buffer(shape: Tuple[int, ...], dtype) -> np.ndarray:
+    """Per-thread reusable array (contents are overwritten by the next caller on this thread)."""
+    buffers = getattr(_resize_scratch, 'buffers', None)
+    if buffers is None:
+        buffers = _resize_scratch.buffers = {}
+    key = (shape, np.dtype(dtype))
+    buffer = buffers.get(key)
+    if buffer is None:
+        buffer = buffers[key] = np.empty(shape, dtype)
+    return buffer
+
+
+def _preprocess_face_into(
+    face_image: np.ndarray,
+    target_size: int,
+    out: np.ndarray,
+    channels_first: bool = False
+) -> np.ndarray:
+    """
+    Resize + normalize one face into out, an (S, S, C) or, channels first, (C, S, S) array.
+    The output dtype selects the encoding: float32 / float16 values in [-1, 1],
+    or uint8 pixels left for a quantized model to dequantize.
+    """
+    if out.dtype == np.float16:
+        # Normalize in float32 on the thread's staging buffer, then narrow once
+        staging = _scratch_buffer(out.shape, np.float32)
+        _preprocess_face_into(face_image, target_size, staging, channels_first)
+        np.copyto(out, staging, casting='same_kind')
+        return out
 
+    if out.dtype == np.float32 and (
+        njit is not None
+        and target_size == _FACENET_SIZE
+        and face_image.dtype == np.uint8
+        and face_image.ndim == 3 and face_image.shape[2] == 3
+        and min(face_image.shape[:2]) >= target_size
+    ):
+        # Downscale and normalize in a single pass over the crop (a CHW output is
+        # written through its HWC-shaped view, so no transpose pass afterwards)
+        height, width = face_image.shape[:2]
+        _area_resize_normalize(
+            face_image,
+            *_cached_area_taps(height, target_size),
+            *_cached_area_taps(width, target_size),
+            out.transpose(1, 2, 0) if channels_first else out
+        )
+        return out
 
-def preprocess_face(face_image: np.ndarray, target_size: int = 160) -> np.ndarray:
+    if out.dtype == np.uint8:
+        if face_image.dtype != np.uint8:
+            raise ValueError("uint8 output needs a uint8 face image")
+        if not channels_first:
+            cv2.resize(face_image, (target_size, target_size), dst=out, interpolation=cv2.INTER_AREA)
+            return out
+
+    # Downsample as uint8 into a reused per-thread buffer; only the final
+    # normalized output is written to memory the caller keeps
+    resized = _scratch_buffer((target_size, target_size) + face_image.shape[2:], face_image.dtype)
+    cv2.resize(face_image, (target_size, target_size), dst=resized, interpolation=cv2.INTER_AREA)
+    if out.dtype == np.uint8:
+        # Channels-first raw pixels: de-interleave the planes
+        cv2.split(resized, list(out))
+        return out
+    if channels_first:
+        # Normalize each (small, downsampled) plane straight into its contiguous output plane
+        for plane, out_plane in zip(cv2.split(resized), out):
+            normalize_image(plane, out=out_plane)
+        return out
+    return normalize_image(resized, out=out)
+
+
+def _face_shape(channel_shape: Tuple[int, ...], target_size: int, layout: str) -> Tuple[int, ...]:
+    """Output shape of one preprocessed face (channel_shape = face.shape[2:]) in the requested layout."""
+    if layout == 'HWC':
+        return (target_size, target_size) + channel_shape
+    if layout == 'CHW':
+        if len(channel_shape) != 1:
+            raise ValueError("CHW layout needs an (H, W, C) face image")
+        return (channel_shape[0], target_size, target_size)
+    raise ValueError(f"Unknown layout: {layout} (expected 'HWC' or 'CHW')")
+
+
+def _check_output_dtype(dtype) -> np.dtype:
+    """Validate the requested preprocess output dtype."""
+    dtype = np.dtype(dtype)
+    if dtype not in _PREPROCESS_DTYPES:
+        raise ValueError(f"Unsupported output dtype: {dtype} (expected float32, float16 or uint8)")
+    return dtype
+
+
+def preprocess_face(
+    face_image: np.ndarray,
+    target_size: int = 160,
+    *,
+    out: Optional[np.ndarray] = None,
+    layout: str = 'HWC',
+    dtype=np.float32
+) -> np.ndarray:
     """
     Preprocess a face image for FaceNet model.
     Resizes to target size and normalizes pixel values.
@@ -124,15 +446,50 @@ def preprocess_face(face_image: np.ndarray, target_size: int = 160) -> np.ndarra
     Args:
         face_image: Input face image as numpy array
         target_size: Target size for both width and height (default: 160 for FaceNet)
+        out: Optional C-contiguous array of the output shape and dtype to fill
+            instead of allocating, e.g. a slot of a page-locked staging slab
+            that is reused for every face
+        layout: 'HWC' (DeepFace / Keras models) or 'CHW' (channels-first
+            consumers such as PyTorch; written directly, no transpose needed)
+        dtype: np.float32 (default) or np.float16 for values in [-1, 1]; np.uint8
+            for quantized models, returning the resized pixels un-normalized
+            (value = pixel * 2/255 - 1, i.e. scale 2/255 and zero point 127.5)
+        
+    Returns:
+        Preprocessed face image ready for model input (out, when given)
+    """
+    shape = _face_shape(face_image.shape[2:], target_size, layout)
+    if out is None:
+        out = np.empty(shape, _check_output_dtype(dtype))
+    return _preprocess_face_into(face_image, target_size, out, channels_first=layout == 'CHW')
+
+
+def preprocess_faces_batch(
+    face_images: List[np.ndarray],
+    target_size: int = 160,
+    layout: str = 'HWC',
+    dtype=np.float32
+) -> np.ndarray:
+    """
+    Preprocess several face crops into one stacked array.
+    Each face gets exactly the same treatment as preprocess_face, written
+    straight into its slot of a single preallocated slab.
+    
+    Args:
+        face_images: RGB face crops (any sizes)
+        target_size: Target size for both width and height (default: 160 for FaceNet)
+        layout: 'HWC' or 'CHW' per face, as in preprocess_face
+        dtype: Output dtype, as in preprocess_face
         
     Returns:
-        Preprocessed face image ready for model input
+        (N, target_size, target_size, 3) array (float32 in [-1, 1] by default)
+        ((N, 3, target_size, target_size) for CHW)
     """
-    # Resize to target size
-    resized = resize_image(face_image, (target_size, target_size))
-    # Normalize
-    normalized = normalize_image(resized)
-    return normalized
+    face_shape = _face_shape((3,), target_size, layout)
+    batch = np.empty((len(face_images),) + face_shape, _check_output_dtype(dtype))
+    for face_image, out in zip(face_images, batch):
+        _preprocess_face_into(face_image, target_size, out, channels_first=layout == 'CHW')
+    return batch
 
 
 def save_image(image: np.ndarray, save_path: str) -> bool:
@@ -147,12 +504,12 @@ def save_image(image: np.ndarray, save_path: str) -> bool:
         True if successful, False otherwise
     """
     try:
-        # Convert RGB to BGR for OpenCV
-        image_bgr = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
-        cv2.imwrite(str(save_path), image_bgr)
-        return True
+        # RGB(A) -> BGR as a strided view (imwrite takes it as is; no cvtColor copy).
+        # Arrays from load_image are already BGR underneath, so this is free for them
+        image_bgr = image[..., 2::-1] if image.ndim == 3 else image
+        return bool(cv2.imwrite(str(save_path), image_bgr))
     except Exception as e:
-        print(f"Error saving image to {save_path}: {e}")
+        logger.warning("Error saving image to %s: %s", save_path, e)
         return False
 
 
@@ -160,7 +517,9 @@ def draw_bounding_box(
     image: np.ndarray,
     bbox: Tuple[int, int, int, int],
     color: Tuple[int, int, int] = (0, 255, 0),
-    thickness: int = 2
+    thickness: int = 2,
+    *,
+    inplace: bool = False
 ) -> np.ndarray:
     """
     Draw a bounding box on an image.
@@ -170,11 +529,23 @@ def draw_bounding_box(
         bbox: Bounding box as (x, y, width, height)
         color: Box color as RGB tuple (default: green)
         thickness: Line thickness (default: 2)
+        inplace: Draw on image itself instead of a copy; use when annotating
+            one frame with many boxes
         
     Returns:
         Image with bounding box drawn
+        
+    Raises:
+        ValueError: If inplace is set and image is not a writable C-contiguous
+            array (e.g. the RGB views returned by load_image; copy it first)
     """
+    if inplace and not (image.flags.writeable and image.flags.c_contiguous):
+        raise ValueError(
+            "draw_bounding_box(inplace=True) needs a writable C-contiguous image; "
+            "pass np.ascontiguousarray(image) or use inplace=False"
+        )
+    
     x, y, w, h = bbox
-    image_copy = image.copy()
-    cv2.rectangle(image_copy, (x, y), (x + w, y + h), color, thickness)
-    return image_copy
+    canvas = image if inplace else image.copy()
+    cv2.rectangle(canvas, (x, y), (x + w, y + h), color, thickness)
+    return canvas
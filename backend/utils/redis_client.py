@@ -0,0 +1,49 @@
+"""
+Shared Redis connection.
+Used for state that must be visible to every worker process (e.g. AI search sessions).
+"""
+
+import threading
+from typing import Optional
+import logging
+
+import config
+
+logger = logging.getLogger(__name__)
+
+_client = None
+_client_checked = False
+_client_lock = threading.Lock()
+
+
+def get_redis() -> Optional["redis.Redis"]:
+    """
+    Get the shared Redis client.
+
+    Returns:
+        A connected redis.Redis instance, or None when REDIS_URL is unset,
+        the redis library is missing, or the server is unreachable
+        (callers then fall back to in-process storage).
+    """
+    global _client, _client_checked
+    if _client_checked:
+        return _client
+
+    with _client_lock:
+        if _client_checked:
+            return _client
+
+        if config.REDIS_URL:
+            try:
+                import redis
+                client = redis.Redis.from_url(config.REDIS_URL)
+                client.ping()
+                _client = client
+                logger.info("Connected to Redis")
+            except ImportError:
+                logger.error("Redis library not installed. Run: pip install redis")
+            except Exception as e:
+                logger.error(f"Failed to connect to Redis: {e}")
+
+        _client_checked = True
+        return _client